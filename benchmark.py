@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the C64 Character Set to TrueType Converter
+
+Times the vectorizer steps, a few table builders and the complete conversion
+on synthetic glyph sets. The results can be saved as JSON and compared against
+an earlier run, e.g.:
+
+./benchmark.py -o before.json
+(make some changes)
+./benchmark.py -o after.json -c before.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import random
+import subprocess
+import timeit
+from datetime import datetime
+
+from fontTools.ttLib import TTFont
+
+import c64ttf
+
+# INPUT DATA
+
+# Each glyph is 8 bytes, top row first, just like in a 64C file.
+EMPTY = bytes(8)
+SOLID = bytes([0xff] * 8)                          # uni2588
+CHECKERBOARD = bytes([0x55, 0xaa] * 4)             # shade
+LETTER_A = bytes([0x18, 0x3c, 0x66, 0x7e, 0x66, 0x66, 0x66, 0x00])
+
+def makeNoise(count, seed=64):
+    rnd = random.Random(seed)
+    return [bytes(rnd.getrandbits(8) for _ in range(8)) for _ in range(count)]
+
+# A 64C file (load address + 256 glyphs) mixing all of the shapes above, with
+# the second half inverted like in the C64 character ROM.
+def makeCharset(seed):
+    glyphs = [[EMPTY, SOLID, CHECKERBOARD, LETTER_A][index % 4] for index in range(64)] + makeNoise(64, seed)
+    glyphs += [bytes(row ^ 0xff for row in glyph) for glyph in glyphs]
+    return bytes([0x00, 0x38]) + b"".join(glyphs)
+
+# A large glyph set beyond what a 64C file can hold, mapped into the PUA.
+def makeLargeGlyphSet(count):
+    glyphs = c64ttf.makeEmptyGlyphs()
+    for index, bitmap in enumerate(makeNoise(count, seed=count)):
+        glyphs["uni{0:04X}".format(0xe000 + index)] = [bitmap, [0xe000 + index]]
+    return glyphs
+
+# BENCHMARKS
+
+# Every benchmark is [name, function] where the function runs one iteration.
+def makeBenchmarks():
+    benchmarks = []
+    shapes = [["empty", EMPTY], ["solid", SOLID], ["shade", CHECKERBOARD], ["A", LETTER_A], ["noise", makeNoise(1)[0]]]
+
+    for name, bitmap in shapes:
+        unpacked = c64ttf.unpackChar(bitmap)
+        edges = c64ttf.scaleEdges(c64ttf.generateEdges(unpacked), 256, 1)
+        contours = c64ttf.mergeContours(edges)
+        benchmarks.append(["unpackChar/" + name, lambda bitmap=bitmap: c64ttf.unpackChar(bitmap)])
+        benchmarks.append(["generateEdges/" + name, lambda unpacked=unpacked: c64ttf.generateEdges(unpacked)])
+        benchmarks.append(["mergeContours/" + name, lambda edges=edges: c64ttf.mergeContours(edges)])
+        benchmarks.append(["makeTTFGlyph/" + name, lambda contours=contours: c64ttf.makeTTFGlyph(contours)])
+        benchmarks.append(["vectorizeGlyph/" + name, lambda bitmap=bitmap: c64ttf.vectorizeGlyph(bitmap, 256, 1)])
+
+    lowercase = makeCharset(1)
+    uppercase = makeCharset(2)
+    lowercaseBitmaps = quietly(c64ttf.parseCharBitmaps, lowercase)
+    uppercaseBitmaps = quietly(c64ttf.parseCharBitmaps, uppercase)
+    fullSet = quietly(c64ttf.makeGlyphs, lowercaseBitmaps, uppercaseBitmaps, True, True, True)
+    largeSet = makeLargeGlyphSet(4096)
+
+    for name, glyphs in [["full", fullSet], ["large", largeSet]]:
+        ttf = TTFont()
+        vectorized = {glyph: [c64ttf.vectorizeGlyph(glyphs[glyph][0], 256, 1), glyphs[glyph][1]] for glyph in glyphs}
+        c64ttf.makeTable_glyf(ttf, vectorized)
+        advanceWidths = {glyph: 2048 * c64ttf.glyphWidth(glyphs[glyph]) // 8 for glyph in glyphs}
+        bounds = c64ttf.measureGlyphs(glyphs, 256, 1)
+        benchmarks.append(["makeTable_hmtx/" + name, lambda ttf=ttf, advanceWidths=advanceWidths, bounds=bounds: c64ttf.makeTable_hmtx(ttf, advanceWidths, bounds)])
+        benchmarks.append(["measureGlyphs/" + name, lambda glyphs=glyphs: c64ttf.measureGlyphs(glyphs, 256, 1)])
+        benchmarks.append(["makeTable_cmap/" + name, lambda ttf=ttf, glyphs=glyphs: quietly(c64ttf.makeTable_cmap, ttf, glyphs)])
+        benchmarks.append(["saveFont/" + name, lambda glyphs=glyphs: quietly(c64ttf.saveFont, glyphs, io.BytesIO(), False, 256, 1, "Bench", 2000, "bench", "1.00")])
+
+    # The same glyphs vectorized with each edge engine, NumPy only if installed.
+    glyphKeys = [c64ttf.glyphKey(bitmap, 8) for bitmap in makeNoise(4096)]
+    for engine in ["python", "numpy"]:
+        if engine == "numpy" and c64ttf.numpy is None:
+            continue
+        benchmarks.append(["vectorizeGlyphKeys/" + engine, lambda engine=engine: c64ttf.vectorizeGlyphKeys(glyphKeys, 256, 1, engine)])
+
+    benchmarks.append(["convertCharsets/add-all", lambda: quietly(c64ttf.convertCharsets, lowercase, uppercase, addMissingASCII=True, addAll=True, creator="bench")])
+    return benchmarks
+
+def quietly(function, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function(*args, **kwargs)
+
+# Returns the best time per iteration in seconds. The number of iterations is
+# chosen so that each repetition takes at least minTime seconds.
+def runBenchmark(function, repeat, minTime):
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < minTime:
+        number *= 2
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+def gitRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+# "static void main()"
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for c64ttf.py")
+    parser.add_argument("-o", "--output", help="Save the results as JSON to this file")
+    parser.add_argument("-c", "--compare", help="Compare against the results in this JSON file")
+    parser.add_argument("-f", "--filter", help="Only run benchmarks whose name contains this string")
+    parser.add_argument("-r", "--repeat", help="Number of repetitions (the best one counts, default is 5)", type=int, default=5)
+    parser.add_argument("-t", "--min-time", help="Minimum time per repetition in seconds (default is 0.05)", type=float, default=0.05)
+    args = parser.parse_args()
+
+    baseline = dict()
+    if args.compare is not None:
+        baseline = json.load(open(args.compare))["results"]
+
+    results = dict()
+    for name, function in makeBenchmarks():
+        if args.filter is not None and args.filter not in name:
+            continue
+        seconds = runBenchmark(function, args.repeat, args.min_time)
+        results[name] = seconds
+        line = "{0:<32} {1:>12.2f} us".format(name, seconds * 1e6)
+        if name in baseline:
+            line += "  {0:>6.2f}x".format(baseline[name] / seconds)
+        print(line)
+
+    if args.output is not None:
+        report = {"revision": gitRevision(),
+                  "date": datetime.now().isoformat(timespec="seconds"),
+                  "python": platform.python_version(),
+                  "platform": platform.platform(),
+                  "results": results}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
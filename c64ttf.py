@@ -33,16 +33,50 @@ import getpass
 import math
 import time
 import array
+import struct
 import os
-
-from fontTools.ttLib import TTFont, newTable
+import json
+import logging
+import hashlib
+import sqlite3
+import glob
+import io
+import contextlib
+import base64
+import threading
+import functools
+import gc
+import sys
+import tracemalloc
+import cProfile
+import select
+import mmap
+import zipfile
+import tarfile
+import re
+import unicodedata
+import ctypes
+import ctypes.util
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import repeat
+
+from fontTools.ttLib import TTFont, TTCollection, newTable, getTableClass
+from fontTools.ttLib import woff2
 from fontTools.ttLib.tables import ttProgram
-from fontTools.ttLib.tables._c_m_a_p import cmap_format_4, cmap_format_0
+from fontTools.ttLib.tables.DefaultTable import DefaultTable
+from fontTools.ttLib.tables._c_m_a_p import CmapSubtable
 from fontTools.ttLib.tables._h_e_a_d import mac_epoch_diff
-from fontTools.ttLib.tables._g_l_y_f import Glyph, GlyphCoordinates
+from fontTools.ttLib.tables._g_l_y_f import Glyph, GlyphCoordinates, GlyphComponent, ROUND_XY_TO_GRID
 from fontTools.ttLib.tables.O_S_2f_2 import Panose
 from fontTools.ttLib.tables._n_a_m_e import NameRecord
 
+# Progress messages of the conversion. The library functions (convertCharsets()
+# etc.) stay quiet unless the caller configures logging; the command line shows
+# them for single fonts.
+log = logging.getLogger("c64ttf")
+
 # DATA SECTION
 
 # Map from a subset of C64 PETSCII to ASCII as well as a few Unicode points.
@@ -436,7 +470,7 @@ def makeEmptyGlyphs():
     return bitmap
 
 def makeMissingDanishChars():
-    print("Adding Danish characters...")
+    log.info("Adding Danish characters...")
     bitmap = dict()
     bitmap["ae"] = [[0b00000000,
                      0b00000000,
@@ -494,7 +528,7 @@ def makeMissingDanishChars():
     return bitmap
 
 def makeMissingASCII():
-    print("Adding the 8 missing ASCII characters in C64 PETSCII...")
+    log.info("Adding the 8 missing ASCII characters in C64 PETSCII...")
     bitmap = dict()
 
     # Grave accent
@@ -579,131 +613,607 @@ def makeMissingASCII():
 
     return bitmap
 
+# INSTRUMENTATION
+
+# Per-stage timings for finding out where the time goes. Functions decorated
+# with @timed (and blocks wrapped in "with stage(name)") are measured while a
+# StageTimings object is active. Each stage records the number of calls and the
+# wall and CPU time. If traceMemory is enabled, the net number of memory blocks
+# and (through tracemalloc) bytes allocated by the stage are recorded as well.
+# Nested stages are included in the numbers of their parents.
+# When no StageTimings object is active, the overhead is a single check.
+
+activeTimings = None
+
+class StageTimings:
+    def __init__(self, traceMemory=False):
+        self.traceMemory = traceMemory
+        self.stages = dict()
+        self.startTime = 0.0
+        self.totalTime = 0.0
+
+    def start(self):
+        global activeTimings
+        if self.traceMemory:
+            tracemalloc.start()
+        self.startTime = time.perf_counter()
+        activeTimings = self
+
+    def stop(self):
+        global activeTimings
+        activeTimings = None
+        self.totalTime += time.perf_counter() - self.startTime
+        if self.traceMemory:
+            tracemalloc.stop()
+
+    def measure(self, name):
+        return Stage(self, name)
+
+    def add(self, name, wall, cpu, blocks, size):
+        entry = self.stages.get(name)
+        if entry is None:
+            entry = self.stages[name] = {"calls": 0, "wall": 0.0, "cpu": 0.0, "allocatedBlocks": 0, "allocatedBytes": 0}
+        entry["calls"] += 1
+        entry["wall"] += wall
+        entry["cpu"] += cpu
+        entry["allocatedBlocks"] += blocks
+        entry["allocatedBytes"] += size
+
+    def results(self):
+        return {"total": self.totalTime, "traceMemory": self.traceMemory, "stages": self.stages}
+
+    def write(self, fileName):
+        if fileName == "-":
+            print(json.dumps(self.results(), indent=2))
+        else:
+            with open(fileName, "w") as f:
+                json.dump(self.results(), f, indent=2)
+
+class Stage:
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        # Counting the blocks takes time proportional to the heap size.
+        self.size = tracemalloc.get_traced_memory()[0] if self.timings.traceMemory else 0
+        self.blocks = sys.getallocatedblocks() if self.timings.traceMemory else 0
+        self.cpu = time.process_time()
+        self.wall = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self.wall
+        cpu = time.process_time() - self.cpu
+        blocks = sys.getallocatedblocks() - self.blocks if self.timings.traceMemory else 0
+        size = tracemalloc.get_traced_memory()[0] - self.size if self.timings.traceMemory else 0
+        self.timings.add(self.name, wall, cpu, blocks, size)
+        return False
+
+noStage = contextlib.nullcontext()
+
+def stage(name):
+    if activeTimings is None:
+        return noStage
+    return activeTimings.measure(name)
+
+def timed(function):
+    name = function.__name__
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if activeTimings is None:
+            return function(*args, **kwargs)
+        with activeTimings.measure(name):
+            return function(*args, **kwargs)
+    return wrapper
+
 # THE VECTORIZATION ALGORITHM
 
-def vectorizeGlyph(glyphData, pixelSize, descent):
+@timed
+def vectorizeGlyph(glyphData, pixelSize, descent, width=8):
     if glyphData is None or len(glyphData) == 0:
         return []
 
-    bitmap = unpackChar(glyphData)
-    edges = generateEdges(bitmap)
+    bitmap = unpackChar(glyphData, width)
+    edges = generateEdges(bitmap, width)
     scaledEdges = scaleEdges(edges, pixelSize, descent)
     return mergeContours(scaledEdges)
 
-# 1) First, we need to unpack the bits in the bitmap and reverse the order so
-#    that [0,0] is the lower left corner. This will make the next step easier
-#    to understand.
-def unpackChar(glyphData):
-    return [[((row >> bit) & 1) == 1 for bit in range(7, -1, -1)] for row in reversed(glyphData)]
+# 1) First, we need to reverse the order of the rows so that row 0 is the
+#    bottom row. Each row is kept as an integer bitmask where the most
+#    significant bit (bit 7 for an 8 pixel wide glyph) is the leftmost pixel.
+#    This will make the next step easier to understand.
+@timed
+def unpackChar(glyphData, width=8):
+    mask = (1 << width) - 1
+    return [row & mask for row in reversed(glyphData)]
 
 # 2) A simple way of vectorizing a b/w bitmap is to simply generate (up to)
 #    four edges going clockwise around each opaque pixel.
-def generateEdges(bitmap):
+#    Rather than testing the neighbours pixel by pixel, the pixels needing an
+#    edge on each side are found for a whole row at a time by masking the row
+#    with its shifted self (left/right) or with the rows below and above.
+@timed
+def generateEdges(bitmap, width=8):
     edges = []
     height = len(bitmap)
-    width = len(bitmap[0])
+    fullRow = (1 << width) - 1
     for y in range(height):
-        for x in range(width):
-            if bitmap[y][x]:
-                # Insert edge to the left of the pixel?
-                if x == 0 or not bitmap[y][x - 1]:
-                    edges.append([[x, y], [x, y + 1]])
-
-                # Insert edge above the pixel?
-                if y == height - 1 or not bitmap[y + 1][x]:
-                    edges.append([[x, y + 1], [x + 1, y + 1]])
-                
-                # Insert edge to the right of the pixel?
-                if x == width - 1 or not bitmap[y][x + 1]:
-                    edges.append([[x + 1, y + 1], [x + 1, y]])
-                
-                # Insert edge below the pixel?
-                if y == 0 or not bitmap[y - 1][x]:
-                    edges.append([[x + 1, y], [x, y]])
+        row = bitmap[y]
+        if row == 0:
+            continue
+        below = bitmap[y - 1] if y > 0 else 0
+        above = bitmap[y + 1] if y < height - 1 else 0
+
+        # Insert edges to the left of the pixels?
+        mask = row & ~(row >> 1)
+        while mask:
+            bit = mask & -mask
+            x = width - bit.bit_length()
+            edges.append(((x, y), (x, y + 1)))
+            mask ^= bit
+
+        # Insert edges above the pixels?
+        mask = row & ~above
+        while mask:
+            bit = mask & -mask
+            x = width - bit.bit_length()
+            edges.append(((x, y + 1), (x + 1, y + 1)))
+            mask ^= bit
+
+        # Insert edges to the right of the pixels?
+        mask = row & ~(row << 1) & fullRow
+        while mask:
+            bit = mask & -mask
+            x = width - bit.bit_length()
+            edges.append(((x + 1, y + 1), (x + 1, y)))
+            mask ^= bit
+
+        # Insert edges below the pixels?
+        mask = row & ~below
+        while mask:
+            bit = mask & -mask
+            x = width - bit.bit_length()
+            edges.append(((x + 1, y), (x, y)))
+            mask ^= bit
     return edges
 
 # 3) Scaling and translation of the vectorized pixels.
+@timed
 def scaleEdges(edges, pixelSize, descent):
     return [[[point[0] * pixelSize, (point[1] - descent) * pixelSize] for point in edge] for edge in edges]
 
 # 4) In a TTF file we have to provide contours rather than just a bunch of
 #    unordered edges. If possible, consecutive edges are merged.
+#    The edges are indexed by their start point so each contour can be traced
+#    without scanning the whole edge list. Where two edges share a start point
+#    (diagonally touching pixels), the smallest edge is always followed first.
+@timed
 def mergeContours(edges):
     edgeList = sorted(edges)
     contours = []
 
-    while len(edgeList) > 1:
-        start = edgeList[0]
-        edgeList.remove(start)
+    # Each list is kept in descending order so pop() returns the smallest edge.
+    outgoing = dict()
+    for edge in reversed(edgeList):
+        outgoing.setdefault(tuple(edge[0]), []).append(edge)
+
+    for start in edgeList:
+        candidates = outgoing[tuple(start[0])]
+        if len(candidates) == 0 or candidates[-1] is not start:
+            # Already part of a previously traced contour.
+            continue
+        candidates.pop()
         current = start
         contour = [start[0], start[1]]
 
         while current[1] != start[0]:
-            next = [edge for edge in edgeList if edge[0] == current[1]][0]
+            next = outgoing[tuple(current[1])].pop()
             if next[1][0] == current[0][0] or next[1][1] == current[0][1]:
                 contour[-1] = next[1]
             else:
                 contour.append(next[1])
             current = next
-            edgeList.remove(current)
-        
+
         # We don't need to include the last edge as it's implicit.
         contours.append(contour[:-1])
 
     return contours
 
+# VECTORIZATION CACHE
+
+# The vectorized contours only depend on the 8 bitmap bytes, the pixel size and
+# the descent, so identical glyphs (e.g. digits present in both character sets
+# or glyphs repeated by --add-all) only need to be traced once. The cache keeps
+# the most recently used entries in memory and can optionally be backed by an
+# SQLite file so repeated builds in separate processes skip the vectorization.
+
+CACHE_SIZE = 4096
+CACHE_FILENAME = "c64ttf-cache.sqlite"
+CACHE_FORMAT = 2                  # Bump whenever the vectorizer output or the key changes
+
+class GlyphCache:
+    def __init__(self, maxSize=CACHE_SIZE, cacheDir=None, engine="auto"):
+        self.maxSize = maxSize
+        self.engine = engine
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.diskHits = 0
+        self.misses = 0
+        self.db = None
+        self.lock = threading.Lock()
+        if cacheDir is not None:
+            os.makedirs(cacheDir, exist_ok=True)
+            self.db = sqlite3.connect(os.path.join(cacheDir, CACHE_FILENAME), timeout=60, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS contours (format INTEGER, bitmap BLOB, pixelSize INTEGER, descent INTEGER, contours TEXT, PRIMARY KEY (format, bitmap, pixelSize, descent))")
+
+    def vectorize(self, glyphData, pixelSize, descent, width=8):
+        with self.lock:
+            key = (glyphKey(glyphData, width), pixelSize, descent)
+            contours = self.find(key)
+            if contours is None:
+                self.misses += 1
+                contours = vectorizeGlyph(glyphData, pixelSize, descent, width)
+                self.store(key, contours)
+            return contours
+
+    # Vectorizes a list of [glyphData, width] and returns the list of contours.
+    # All glyphs missing from the cache are vectorized in one go, which allows
+    # large sets of them to be split between several workers.
+    def vectorizeAll(self, bitmaps, pixelSize, descent, workers=None):
+        with self.lock:
+            results = [None] * len(bitmaps)
+            missing = OrderedDict()
+            for index, (glyphData, width) in enumerate(bitmaps):
+                key = (glyphKey(glyphData, width), pixelSize, descent)
+                if key in missing:
+                    self.hits += 1
+                    missing[key].append(index)
+                    continue
+                results[index] = self.find(key)
+                if results[index] is None:
+                    self.misses += 1
+                    missing[key] = [index]
+
+            if len(missing) > 0:
+                glyphKeys = [key[0] for key in missing]
+                for key, contours in zip(missing, vectorizeGlyphs(glyphKeys, pixelSize, descent, workers, self.engine)):
+                    self.store(key, contours)
+                    for index in missing[key]:
+                        results[index] = contours
+            return results
+
+    def find(self, key):
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        if self.db is not None:
+            row = self.db.execute("SELECT contours FROM contours WHERE format = ? AND bitmap = ? AND pixelSize = ? AND descent = ?", (CACHE_FORMAT,) + key).fetchone()
+            if row is not None:
+                self.diskHits += 1
+                contours = json.loads(row[0])
+                self.remember(key, contours)
+                return contours
+
+        return None
+
+    def store(self, key, contours):
+        if self.db is not None:
+            self.db.execute("INSERT OR REPLACE INTO contours VALUES (?, ?, ?, ?, ?)", (CACHE_FORMAT,) + key + (json.dumps(contours),))
+        self.remember(key, contours)
+
+    def remember(self, key, contours):
+        self.entries[key] = contours
+        if len(self.entries) > self.maxSize:
+            self.entries.popitem(last=False)
+
+    def report(self):
+        lookups = self.hits + self.diskHits + self.misses
+        print("Vectorization cache: {0} lookups, {1} memory hits, {2} disk hits, {3} misses".format(lookups, self.hits, self.diskHits, self.misses))
+
+    def commit(self):
+        if self.db is not None:
+            self.db.commit()
+
+    def close(self):
+        if self.db is not None:
+            self.db.commit()
+            self.db.close()
+            self.db = None
+
+# The glyph width followed by the rows packed into whole bytes.
+def glyphKey(glyphData, width):
+    if width <= 8:
+        return struct.pack(">H", width) + bytes(glyphData)
+    bytesPerRow = (width + 7) // 8
+    return struct.pack(">H", width) + b"".join(row.to_bytes(bytesPerRow, "big") for row in glyphData)
+
+def unpackGlyphKey(key):
+    width = struct.unpack_from(">H", key)[0]
+    bytesPerRow = (width + 7) // 8
+    return [int.from_bytes(key[idx:idx + bytesPerRow], "big") for idx in range(2, len(key), bytesPerRow)], width
+
+# PARALLEL VECTORIZATION
+
+# Large glyph sets are split into chunks that are vectorized by a pool of
+# worker processes (or threads on a free-threaded Python build). Each chunk is
+# sent as a single buffer of glyph keys and the contours come back as a single
+# array of integers: for each glyph the number of contours, and for each contour
+# the number of points followed by the x and y coordinates.
+# Smaller sets are vectorized serially as starting the workers costs more than
+# it saves. The result is the same either way.
+
+PARALLEL_MIN_GLYPHS = 2048
+PARALLEL_CHUNK_SIZE = 512
+
+def vectorizeGlyphs(glyphKeys, pixelSize, descent, workers=None, engine="auto"):
+    if workers is None:
+        workers = (os.cpu_count() or 1) if len(glyphKeys) >= PARALLEL_MIN_GLYPHS else 1
+    if workers <= 1 or len(glyphKeys) <= PARALLEL_CHUNK_SIZE:
+        return vectorizeGlyphKeys(glyphKeys, pixelSize, descent, engine)
+
+    chunks = [packGlyphKeys(glyphKeys[idx:idx + PARALLEL_CHUNK_SIZE]) for idx in range(0, len(glyphKeys), PARALLEL_CHUNK_SIZE)]
+    freeThreaded = not getattr(sys, "_is_gil_enabled", lambda: True)()
+    executor = ThreadPoolExecutor if freeThreaded else ProcessPoolExecutor
+    with stage("vectorizeGlyphs.parallel"), executor(max_workers=min(workers, len(chunks))) as pool:
+        packedContours = list(pool.map(vectorizeChunk, chunks, repeat(pixelSize), repeat(descent), repeat(engine)))
+    return [contours for packed in packedContours for contours in unpackContours(packed)]
+
+def packGlyphKeys(glyphKeys):
+    return b"".join(struct.pack(">I", len(key)) + key for key in glyphKeys)
+
+def vectorizeChunk(chunk, pixelSize, descent, engine="auto"):
+    glyphKeys = []
+    offset = 0
+    while offset < len(chunk):
+        size = struct.unpack_from(">I", chunk, offset)[0]
+        glyphKeys.append(chunk[offset + 4:offset + 4 + size])
+        offset += 4 + size
+
+    packed = array.array("l")
+    for polygons in vectorizeGlyphKeys(glyphKeys, pixelSize, descent, engine):
+        packed.append(len(polygons))
+        for polygon in polygons:
+            packed.append(len(polygon))
+            for point in polygon:
+                packed.extend(point)
+    return packed.tobytes()
+
+def unpackContours(data):
+    packed = array.array("l")
+    packed.frombytes(data)
+    offset = 0
+    while offset < len(packed):
+        polygons = []
+        for _ in range(packed[offset]):
+            count = packed[offset + 1]
+            points = packed[offset + 2:offset + 2 + 2 * count]
+            polygons.append([[points[idx], points[idx + 1]] for idx in range(0, len(points), 2)])
+            offset += 1 + 2 * count
+        offset += 1
+        yield polygons
+
+# BATCH EDGE EXTRACTION
+
+# With NumPy installed, the edges of a whole set of glyphs are found at once.
+# The glyphs of each size are stacked into a single (glyphs, height, width)
+# boolean array with an empty border, and the pixels needing an edge on each
+# side are found by comparing the array with itself shifted by one pixel. This
+# replaces steps 1) to 3) of the vectorization algorithm, only the contours are
+# still traced one glyph at a time. The result is the same as without NumPy.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EDGE_ENGINES = ["auto", "python", "numpy"]
+
+# For each side: the offset [dy, dx] of the neighbouring pixel, and the offsets
+# [x0, y0, x1, y1] of the edge from the pixel, going clockwise as in step 2).
+EDGE_SIDES = [[[0, -1], [0, 0, 0, 1]],  # left
+              [[1, 0], [0, 1, 1, 1]],   # above
+              [[0, 1], [1, 1, 1, 0]],   # right
+              [[-1, 0], [1, 0, 0, 0]]]  # below
+
+def vectorizeGlyphKeys(glyphKeys, pixelSize, descent, engine="auto"):
+    if engine == "auto":
+        engine = "numpy" if numpy is not None else "python"
+    if engine == "python":
+        return [vectorizeGlyph(glyphData, pixelSize, descent, width) for glyphData, width in map(unpackGlyphKey, glyphKeys)]
+    if numpy is None:
+        raise ValueError("The numpy edge engine requires NumPy to be installed")
+    return [mergeContours(edges) for edges in generateScaledEdgesNumpy(glyphKeys, pixelSize, descent)]
+
+@timed
+def generateScaledEdgesNumpy(glyphKeys, pixelSize, descent):
+    groups = dict()
+    for index, key in enumerate(glyphKeys):
+        groups.setdefault((struct.unpack_from(">H", key)[0], len(key)), []).append(index)
+
+    results = [None] * len(glyphKeys)
+    for (width, size), indices in groups.items():
+        bytesPerRow = (width + 7) // 8
+        height = (size - 2) // bytesPerRow
+        data = numpy.frombuffer(b"".join(glyphKeys[index][2:] for index in indices), dtype=numpy.uint8)
+        # Row 0 is the bottom row, and the rows are right aligned in their bytes.
+        bits = numpy.unpackbits(data.reshape(len(indices), height, bytesPerRow), axis=2)[:, ::-1, bytesPerRow * 8 - width:]
+        padded = numpy.zeros((len(indices), height + 2, width + 2), dtype=bool)
+        padded[:, 1:-1, 1:-1] = bits
+        pixels = padded[:, 1:-1, 1:-1]
+
+        glyphNumbers = []
+        edges = []
+        for [dy, dx], offsets in EDGE_SIDES:
+            neighbours = padded[:, 1 + dy:height + 1 + dy, 1 + dx:width + 1 + dx]
+            glyph, y, x = numpy.nonzero(pixels & ~neighbours)
+            glyphNumbers.append(glyph)
+            edges.append(numpy.stack([x + offsets[0], y + offsets[1], x + offsets[2], y + offsets[3]], axis=1))
+
+        glyphNumbers = numpy.concatenate(glyphNumbers)
+        order = numpy.argsort(glyphNumbers, kind="stable")
+        edges = numpy.concatenate(edges)[order]
+        edges[:, 1::2] -= descent
+        edgeList = (edges * pixelSize).reshape(-1, 2, 2).tolist()
+        bounds = numpy.searchsorted(glyphNumbers[order], numpy.arange(len(indices) + 1)).tolist()
+        for number, index in enumerate(indices):
+            results[index] = edgeList[bounds[number]:bounds[number + 1]]
+    return results
+
 # TRUETYPE FONT HANDLING
 
-def saveFont(glyphs, outputFileName, asXML, pixelSize, descent, fontName, copyrightYear, creator, version):
+# Each glyph is [rows, [unicodes]] or [rows, [unicodes], width] where the rows
+# are listed top row first. Glyphs are 8 pixels wide unless a width is given.
+# The em square is as tall as the tallest glyph and the advance width of each
+# glyph is in proportion to that.
+def glyphWidth(glyph):
+    return glyph[2] if len(glyph) > 2 else 8
+
+@contextlib.contextmanager
+def garbageCollectionPaused():
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+# The glyph data contains no reference cycles, so there's no point in letting
+# the garbage collector scan the ever growing set of contours and tables.
+@timed
+@garbageCollectionPaused()
+def saveFont(glyphs, outputFileName, asXML, pixelSize, descent, fontName, copyrightYear, creator, version, cache=None, fastPath=True, workers=None, state=None, formats=None, strikes=None, composites=False):
     f = TTFont()
 
-    vectorizedGlyphs = {glyph : [vectorizeGlyph(glyphs[glyph][0], pixelSize, descent), glyphs[glyph][1]] for glyph in glyphs}
+    if cache is None:
+        cache = GlyphCache()
+
+    if formats is None:
+        formats = ["ttx" if asXML else "ttf"]
+    outputs = outputFileNames(outputFileName, formats)
+    if "woff2" in formats and not woff2.haveBrotli:
+        raise ValueError("WOFF2 output requires the brotli module to be installed")
+    if "ttc" in formats:
+        raise ValueError("TTC output is written by saveCollection() and can't be combined with other formats")
+
+    # The TTX output needs the fontTools glyph objects, but binary output can
+    # use the glyf, loca and hmtx tables packed directly from the contours.
+    fastPath = fastPath and "ttx" not in formats
+
+    compositeGlyphs = dict()
+    cells = dict()
+    if composites:
+        compositeGlyphs, cells = findCompositeGlyphs(glyphs, pixelSize)
+        glyphs = dict(glyphs, **cells)
+        log.info("Composite glyphs: {0} of {1} glyphs".format(len(compositeGlyphs), len(glyphs)))
+
+    records = dict()
+    if state is not None and not fastPath:
+        if state.fileName is not None:
+            log.info("Incremental builds need binary output without --no-fast-path, building everything.")
+        state = None
+    if state is not None:
+        records = state.unchangedRecords(glyphs, pixelSize, descent)
+        records = {glyph: record for glyph, record in records.items() if glyph not in compositeGlyphs}
+        log.info("Incremental build: {0} of {1} glyphs changed".format(len(glyphs) - len(records) - len(compositeGlyphs), len(glyphs)))
+
+    cellWidth, cellHeight, bounds = makeGlyphTables(f, glyphs, pixelSize, descent, cache, fastPath, workers, records, compositeGlyphs, cells, strikes)
     unicodes = [code for glyph in glyphs for code in glyphs[glyph][1]]
+    metrics = fontMetrics(f, glyphs, bounds)
+
+    staticTables = None
+    if state is not None:
+        signature = staticTableSignature(f.getGlyphOrder(), glyphs, pixelSize, descent, fontName, copyrightYear, creator, version, cellWidth, cellHeight, metrics)
+        staticTables = state.staticTables(signature)
+    if staticTables is not None:
+        for tag in STATIC_TABLES:
+            f[tag] = DefaultTable(tag)
+            f[tag].data = staticTables[tag]
+    else:
+        makeTable_OS2(f, pixelSize, descent, min(unicodes), max(unicodes), cellWidth, cellHeight, metrics)
+        makeTable_cmap(f, glyphs)
+        makeTable_name(f, fontName, "Regular", copyrightYear, creator, version)
+        makeTable_post(f, pixelSize, descent)
+
+    # Compiling the tables also auto-calculates stuff here and there, which the
+    # TTX output needs as well.
+    with stage("compile"):
+        tableData = compileTables(f)
+        if strikes and "ttx" in formats:
+            # Show the strikes as bitmaps rather than hex data.
+            decompileTables(f, tableData, ["EBLC", "EBDT"])
+    if "ttx" in formats:
+        log.info("PLEASE NOTE: When exporting directly to XML, the checkSumAdjustment value in the head table will be 0.")
+    writeFonts(f, tableData, outputs)
+
+    if state is not None:
+        if staticTables is None:
+            staticTables = {tag: tableData[tag] for tag in STATIC_TABLES}
+        state.update(pixelSize, descent, f["glyf"].records, signature, staticTables)
+
+# Builds the glyf, loca, maxp, head, hmtx and hhea tables (and the strikes).
+# Glyphs with a record are not vectorized again. Returns the cell size and the
+# bounds of the glyphs (see BITMAP METRICS).
+def makeGlyphTables(f, glyphs, pixelSize, descent, cache, fastPath, workers, records, compositeGlyphs, cells, strikes):
+    with stage("vectorize"):
+        changedGlyphs = [glyph for glyph in glyphs if glyph not in records and glyph not in compositeGlyphs and glyph not in cells]
+        contours = cache.vectorizeAll([[glyphs[glyph][0], glyphWidth(glyphs[glyph])] for glyph in changedGlyphs], pixelSize, descent, workers)
+        vectorizedGlyphs = {glyph : [polygons, glyphs[glyph][1]] for glyph, polygons in zip(changedGlyphs, contours)}
+        for cell in cells:
+            if cell not in records:
+                vectorizedGlyphs[cell] = [cellPolygons(glyphWidth(cells[cell]), len(cells[cell][0]), pixelSize, descent), []]
+
+    cellHeight = max([len(glyphs[glyph][0]) for glyph in glyphs] + [1]) if glyphs else 8
+    cellWidth = max(glyphWidth(glyphs[glyph]) for glyph in glyphs) if glyphs else 8
+    advanceWidths = {glyph: 2048 * glyphWidth(glyphs[glyph]) // cellHeight for glyph in glyphs}
+    bounds = measureGlyphs(glyphs, pixelSize, descent)
 
     # Populate basic tables (there are a few dependencies so order matters)
-    makeTable_glyf(f, vectorizedGlyphs)
+    if fastPath:
+        makeRawTable_glyf(f, vectorizedGlyphs, bounds, records, compositeGlyphs)
+    else:
+        makeTable_glyf(f, vectorizedGlyphs, compositeGlyphs)
     makeTable_maxp(f)
-    makeTable_loca(f)
+    if not fastPath:
+        makeTable_loca(f)
     makeTable_head(f)
-    makeTable_hmtx(f)
-    makeTable_hhea(f, pixelSize, descent)
-    makeTable_OS2(f, pixelSize, descent, min(unicodes), max(unicodes))
-    makeTable_cmap(f, glyphs)
-    makeTable_name(f, fontName, "Regular", copyrightYear, creator, version)
-    makeTable_post(f, pixelSize, descent)
-
-    if asXML:
-        # We have to compile the TTFont manually when saving as TTX
-        # (to auto-calculate stuff here and there)
-        f["glyf"].compile(f)
-        f["maxp"].compile(f)
-        f["loca"].compile(f)
-        f["head"].compile(f)
-        f["hmtx"].compile(f)
-        f["hhea"].compile(f)
-        f["OS/2"].compile(f)
-        f["cmap"].compile(f)
-        f["name"].compile(f)
-        f["post"].compile(f)
-        print("PLEASE NOTE: When exporting directly to XML, the checkSumAdjustment value in the head table will be 0.")
-        f.saveXML(outputFileName)
+    if fastPath:
+        makeRawTable_hmtx(f, advanceWidths)
     else:
-        f.save(outputFileName)
+        makeTable_hmtx(f, advanceWidths, bounds)
+    makeTable_hhea(f, pixelSize, descent, cellHeight)
+    if fastPath:
+        recalcRawTables(f)
+    if strikes:
+        makeRawTables_EBLC_EBDT(f, glyphs, strikes, pixelSize, descent, advanceWidths)
+
+    return cellWidth, cellHeight, bounds
 
 # glyf - Glyph Data
-def makeTable_glyf(ttf, glyphs):
+@timed
+def makeTable_glyf(ttf, glyphs, composites=None):
 
     glyf = newTable("glyf")
 
     glyf.glyphs = {glyph: makeTTFGlyph(glyphs[glyph][0]) for glyph in glyphs}
-
-    # We need to sort the glyphs in a specific way (so all basic glyphs are below index 256) to work around a MacRoman related quirk.
-    glyf.glyphOrder = sorted([key for key in glyf.glyphs.keys() if not key.startswith('uni')])
-    glyf.glyphOrder += sorted([key for key in glyf.glyphs.keys() if key.startswith('uni')])
+    for glyph, components in (composites or dict()).items():
+        glyf.glyphs[glyph] = makeTTFCompositeGlyph(components)
+    glyf.glyphOrder = makeGlyphOrder(glyf.glyphs)
 
     ttf["glyf"] = glyf
     ttf.glyphOrder = glyf.glyphOrder
 
+# We need to sort the glyphs in a specific way (so all basic glyphs are below index 256) to work around a MacRoman related quirk.
+def makeGlyphOrder(glyphNames):
+    glyphOrder = sorted([key for key in glyphNames if not key.startswith('uni')])
+    glyphOrder += sorted([key for key in glyphNames if key.startswith('uni')])
+    return glyphOrder
+
+@timed
 def makeTTFGlyph(polygons):
     result = Glyph()
     result.numberOfContours = len(polygons)
@@ -714,7 +1224,22 @@ def makeTTFGlyph(polygons):
     result.program.assembly = []
     return result
 
+@timed
+def makeTTFCompositeGlyph(components):
+    result = Glyph()
+    result.numberOfContours = -1
+    result.components = []
+    for baseName, dx, dy in components:
+        component = GlyphComponent()
+        component.glyphName = baseName
+        component.x = dx
+        component.y = dy
+        component.flags = ROUND_XY_TO_GRID
+        result.components.append(component)
+    return result
+
 # maxp - Maximum Profile
+@timed
 def makeTable_maxp(ttf):
     maxp = newTable("maxp")
     
@@ -737,11 +1262,13 @@ def makeTable_maxp(ttf):
     ttf["maxp"] = maxp
 
 # loca - Index to Location
+@timed
 def makeTable_loca(ttf):
     # Nothing to do here... Locations are auto-calculated by glyf.compile()
     ttf["loca"] = newTable("loca")
 
 # head - Font Header
+@timed
 def makeTable_head(ttf):
     head = newTable("head")
     
@@ -766,7 +1293,9 @@ def makeTable_head(ttf):
     ttf["head"] = head
 
 # hmtx - Horizontal Metrics
-def makeTable_hmtx(ttf):
+# The left side bearings come from the bounds of the bitmaps.
+@timed
+def makeTable_hmtx(ttf, advanceWidths, bounds):
     hmtx = newTable("hmtx")
     hmtx.metrics = dict()
 
@@ -774,20 +1303,18 @@ def makeTable_hmtx(ttf):
         if glyphName == ".null":
             hmtx[".null"] = (0, 0)
         else:
-            glyph = ttf["glyf"].glyphs[glyphName]
-            lsb = 0
-            if hasattr(glyph, "coordinates") and len(glyph.coordinates) > 0:
-                lsb = min([coord[0] for coord in glyph.coordinates])
-            hmtx[glyphName] = (2048, lsb)
+            lsb = bounds[glyphName][0] if bounds[glyphName] is not None else 0
+            hmtx[glyphName] = (advanceWidths[glyphName], lsb)
     
     ttf["hmtx"] = hmtx
 
 # hhea - Horizontal Header
-def makeTable_hhea(ttf, pixelSize, descent):
+@timed
+def makeTable_hhea(ttf, pixelSize, descent, cellHeight=8):
     hhea = newTable("hhea")
     
     hhea.tableVersion = 1.0
-    hhea.ascent = (8 - descent) * pixelSize
+    hhea.ascent = (cellHeight - descent) * pixelSize
     hhea.descent = -descent * pixelSize
     hhea.lineGap = 0
     hhea.advanceWidthMax = 0      # Auto-calculated by hhea.compile()
@@ -807,14 +1334,18 @@ def makeTable_hhea(ttf, pixelSize, descent):
     ttf["hhea"] = hhea
 
 # OS/2 - OS/2 and Windows Specific Metrics
-def makeTable_OS2(ttf, pixelSize, descentPixels, minUnicode, maxUnicode):
-    size = 8 * pixelSize
+# The metrics are [average advance width, x-height, cap height] (see BITMAP
+# METRICS). Missing ones are guessed from the cell size.
+@timed
+def makeTable_OS2(ttf, pixelSize, descentPixels, minUnicode, maxUnicode, cellWidth=8, cellHeight=8, metrics=None):
+    size = cellHeight * pixelSize
     descent = pixelSize * descentPixels
+    averageWidth, xHeight, capHeight = metrics or [None, None, None]
 
     os_2 = newTable("OS/2")
     
     os_2.version = 4
-    os_2.xAvgCharWidth = size
+    os_2.xAvgCharWidth = averageWidth if averageWidth is not None else cellWidth * pixelSize
     os_2.usWeightClass = 400      # Meaning "Normal (Regular)"
     os_2.usWidthClass = 5         # Meaing "Medium (normal)"
     os_2.fsType = 0               # Windows-only licensing bits...
@@ -856,8 +1387,8 @@ def makeTable_OS2(ttf, pixelSize, descentPixels, minUnicode, maxUnicode):
     os_2.usWinDescent = descent
     os_2.ulCodePageRange1 = 0b00000000000000000000000000000001 # Latin 1 (Code page 1252)
     os_2.ulCodePageRange2 = 0b11000000000000000000000000000000 # WE/Latin 1 (Code page 850) + US (Code page 437)
-    os_2.sxHeight = 6 * pixelSize - descent                    # Guess (we don't always have a lower-case "x" at 0x78 to measure (as the standard suggests))
-    os_2.sCapHeight = size - descent
+    os_2.sxHeight = xHeight if xHeight is not None else size * 3 // 4 - descent   # Guess without a lower-case "x" at 0x78 to measure
+    os_2.sCapHeight = capHeight if capHeight is not None else size - descent      # Guess without an "H" at 0x48 to measure
     os_2.usDefaultChar = 0
     os_2.usBreakChar = 32
     os_2.usMaxContex = 0
@@ -865,38 +1396,83 @@ def makeTable_OS2(ttf, pixelSize, descentPixels, minUnicode, maxUnicode):
     ttf["OS/2"] = os_2
 
 # cmap - Character to Glyph Mapping
-def makeTable_cmap(ttf, glyphs):
-    unicodeCMAP = {index: glyph for glyph in glyphs if glyph in ttf["glyf"].glyphs for index in glyphs[glyph][1]}
-    macRoman = dict(CMAP_MACROMAN)
-    macRomanCMAP = {index: macRoman[index] if index in macRoman and macRoman[index] in ttf["glyf"].glyphs else '.notdef' for index in range(256)}
 
-    # Unicode
-    cmap4_0_3 = cmap_format_4(4)
-    cmap4_0_3.platformID = 0
-    cmap4_0_3.platEncID = 3
-    cmap4_0_3.language = 0
-    cmap4_0_3.cmap = unicodeCMAP
+# The Unicode mapping is always written as format 4 for the BMP (Windows needs
+# a 3/1 format 4 subtable, and older systems only read that), next to the Mac
+# Roman subtable. Code points beyond the BMP (e.g. the Symbols for Legacy
+# Computing at U+1FB00) add format 12 subtables with the full mapping. If the
+# BMP part is too large for format 4 (at most 64 KB), only format 12 is left.
+# Format 13 maps ranges of code points to one glyph, which our fonts don't
+# have, and is only meant for last resort fonts, so it is never used.
+# The Unicode and the Windows entries of each format share one mapping, which
+# fontTools compiles and stores once. Format 4 is compiled here to check that
+# it fits and keeps its compiled data (the way fontTools keeps a subtable read
+# from a file), so it isn't compiled again with the table.
+CMAP_UNICODE_ENCODINGS = {4: [[0, 3], [3, 1]], 12: [[0, 4], [3, 10]]}
+CMAP_MACROMAN_SIZE = 6 + 256
+
+# Glyphs can have another name in the font than in the glyphs (see TRUETYPE
+# COLLECTIONS), given by renames.
+@timed
+def makeTable_cmap(ttf, glyphs, renames=None):
+    renames = renames or dict()
+    glyphNames = set(ttf.getGlyphOrder())
+    fontNames = {glyph: renames.get(glyph, glyph) for glyph in glyphs if renames.get(glyph, glyph) in glyphNames}
+    unicodeCMAP = {index: fontNames[glyph] for glyph in fontNames for index in glyphs[glyph][1]}
+    macRoman = dict(CMAP_MACROMAN)
+    macRomanCMAP = {index: fontNames[macRoman[index]] if index in macRoman and macRoman[index] in fontNames else '.notdef' for index in range(256)}
 
     # Mac Roman
-    cmap0_1_0 = cmap_format_0(0)
-    cmap0_1_0.platformID = 1
-    cmap0_1_0.platEncID = 0
-    cmap0_1_0.language = 0
-    cmap0_1_0.cmap = macRomanCMAP
-
-    # Windows
-    cmap4_3_1 = cmap_format_4(4)
-    cmap4_3_1.platformID = 3
-    cmap4_3_1.platEncID = 1
-    cmap4_3_1.language = 0
-    cmap4_3_1.cmap = unicodeCMAP
+    tables = [makeCmapSubtable(0, 1, 0, macRomanCMAP)]
+    sizes = OrderedDict()
+
+    # Unicode and Windows (BMP)
+    beyondBMP = max(unicodeCMAP, default=0) > 0xffff
+    bmpCMAP = {index: glyph for index, glyph in unicodeCMAP.items() if index <= 0xffff} if beyondBMP else unicodeCMAP
+    unicodeSubtable = makeCmapSubtable(4, *CMAP_UNICODE_ENCODINGS[4][0], bmpCMAP)
+    try:
+        data = unicodeSubtable.compile(ttf)
+        unicodeSubtable.decompileHeader(data, ttf)
+        sizes[4] = len(data)
+        tables += [unicodeSubtable, makeCmapSubtable(4, *CMAP_UNICODE_ENCODINGS[4][1], bmpCMAP)]
+    except struct.error:
+        # Format 4 overflows
+        pass
+
+    # Unicode and Windows (full repertoire)
+    if beyondBMP or 4 not in sizes:
+        sizes[12] = cmapFormat12Size(ttf, unicodeCMAP)
+        tables += [makeCmapSubtable(12, platformID, platEncID, unicodeCMAP) for platformID, platEncID in CMAP_UNICODE_ENCODINGS[12]]
 
     cmap = newTable("cmap")
     cmap.tableVersion = 0
-    cmap.tables = [cmap4_0_3, cmap0_1_0, cmap4_3_1]
+    cmap.tables = tables
     ttf["cmap"] = cmap
 
+    subtables = ", ".join("format {0}: {1} bytes".format(format, sizes[format]) for format in sizes)
+    log.info("cmap: {0} bytes ({1})".format(4 + 8 * len(tables) + sum(sizes.values()) + CMAP_MACROMAN_SIZE, subtables))
+
+def cmapFormat12Size(ttf, mapping):
+    glyphIDs = ttf.getReverseGlyphMap()
+    groups = 0
+    lastCode, lastGlyphID = -2, -2
+    for code in sorted(mapping):
+        glyphID = glyphIDs[mapping[code]]
+        if code != lastCode + 1 or glyphID != lastGlyphID + 1:
+            groups += 1
+        lastCode, lastGlyphID = code, glyphID
+    return 16 + 12 * groups
+
+def makeCmapSubtable(format, platformID, platEncID, mapping):
+    subtable = CmapSubtable.newSubtable(format)
+    subtable.platformID = platformID
+    subtable.platEncID = platEncID
+    subtable.language = 0
+    subtable.cmap = mapping
+    return subtable
+
 # name - Naming Table
+@timed
 def makeTable_name(ttf, fontName, subFamily, copyrightYear, creator, version):
     copyright = "Copyright {0} {1}".format(copyrightYear, creator)
     fullName = "{0} {1}".format(fontName, subFamily)
@@ -925,6 +1501,7 @@ def makeNameRecord(nameID, string, platformID, platEncID, langID, encoding):
     return rec
 
 # post - Postscript Information
+@timed
 def makeTable_post(ttf, pixelSize, descent):
     post = newTable("post")
 
@@ -944,69 +1521,849 @@ def makeTable_post(ttf, pixelSize, descent):
 
     ttf["post"] = post
 
+# RAW GLYF/LOCA/HMTX OUTPUT
+
+# Our outlines consist of on-curve integer points only, so the glyf, loca and
+# hmtx tables can be packed directly instead of going through fontTools' Glyph
+# objects. The output is byte for byte what fontTools would produce (greedy
+# delta encoding, loca padding rules, hmtx run length trimming). As fontTools
+# no longer sees the glyph outlines, the values it would recalculate from them
+# (head bounds and flags, maxp, hhea extents) are set by recalcRawTables().
+
+FLAG_ON_CURVE = 0x01
+FLAG_X_SHORT = 0x02
+FLAG_Y_SHORT = 0x04
+FLAG_REPEAT = 0x08
+FLAG_X_SAME = 0x10
+FLAG_Y_SAME = 0x20
+
+# Each record is [glyph data, bounds, number of points, number of contours].
+# Glyphs that already have a record (from an earlier build) are not compiled
+# again. Composite glyphs (see COMPOSITE GLYPHS) refer to other glyphs by their
+# index, so they are compiled once the glyph order is known and never kept as
+# records.
+@timed
+def makeRawTable_glyf(ttf, glyphs, glyphBounds, records=None, composites=None):
+    records = dict(records or ())
+    composites = composites or dict()
+    for glyphName in glyphs:
+        polygons = glyphs[glyphName][0]
+        records[glyphName] = [compileRawGlyph(polygons, glyphBounds[glyphName]), glyphBounds[glyphName], sum(len(polygon) for polygon in polygons), len(polygons)]
+
+    glyphOrder = makeGlyphOrder(list(records.keys()) + list(composites.keys()))
+    glyphIDs = {glyphName: glyphID for glyphID, glyphName in enumerate(glyphOrder)}
+    compositeRecords = {glyphName: compileRawComposite(components, records, glyphIDs, glyphBounds[glyphName]) for glyphName, components in composites.items()}
+    allRecords = dict(records, **compositeRecords)
+
+    dataList = [allRecords[glyphName][0] for glyphName in glyphOrder]
+    bounds = {glyphName: allRecords[glyphName][1] for glyphName in glyphOrder if allRecords[glyphName][1] is not None}
+    maxPoints = max([records[glyphName][2] for glyphName in records] + [0])
+    maxContours = max([records[glyphName][3] for glyphName in records] + [0])
+    maxCompositePoints = max([record[2] for record in compositeRecords.values()] + [0])
+    maxCompositeContours = max([record[3] for record in compositeRecords.values()] + [0])
+    maxComponentElements = max([len(components) for components in composites.values()] + [0])
+
+    # Same as fontTools' default glyf padding: odd glyphs are only padded if
+    # that makes short loca offsets possible.
+    size = sum(len(data) for data in dataList)
+    oddGlyphs = sum(len(data) % 2 for data in dataList)
+    if size < 0x20000 and oddGlyphs > 0 and size + oddGlyphs < 0x20000:
+        dataList = [data + b"\0" if len(data) % 2 else data for data in dataList]
+
+    locations = [0]
+    for data in dataList:
+        locations.append(locations[-1] + len(data))
+
+    if locations[-1] < 0x20000 and all(location % 2 == 0 for location in locations):
+        indexToLocFormat = 0
+        locaData = struct.pack(">{0}H".format(len(locations)), *[location // 2 for location in locations])
+    else:
+        indexToLocFormat = 1
+        locaData = struct.pack(">{0}I".format(len(locations)), *locations)
+
+    glyf = DefaultTable("glyf")
+    glyf.data = b"".join(dataList) or b"\0"
+    glyf.bounds = bounds
+    glyf.maxPoints = maxPoints
+    glyf.maxContours = maxContours
+    glyf.maxCompositePoints = maxCompositePoints
+    glyf.maxCompositeContours = maxCompositeContours
+    glyf.maxComponentElements = maxComponentElements
+    glyf.indexToLocFormat = indexToLocFormat
+    glyf.records = records
+
+    loca = DefaultTable("loca")
+    loca.data = locaData
+
+    ttf["glyf"] = glyf
+    ttf["loca"] = loca
+    ttf.glyphOrder = glyphOrder
+
+# Returns the glyph data. The bounds are those of its bitmap.
+def compileRawGlyph(polygons, glyphBounds):
+    if len(polygons) == 0:
+        return b""
+
+    xs = [point[0] for polygon in polygons for point in polygon]
+    ys = [point[1] for polygon in polygons for point in polygon]
+
+    endPtsOfContours = []
+    count = 0
+    for polygon in polygons:
+        count += len(polygon)
+        endPtsOfContours.append(count - 1)
+
+    flags = bytearray()
+    xData = bytearray()
+    yData = bytearray()
+    lastFlag = None
+    repeat = 0
+    lastX = 0
+    lastY = 0
+    for x, y in zip(xs, ys):
+        dx = x - lastX
+        dy = y - lastY
+        lastX = x
+        lastY = y
+
+        flag = FLAG_ON_CURVE
+        if dx == 0:
+            flag |= FLAG_X_SAME
+        elif -255 <= dx <= 255:
+            flag |= FLAG_X_SHORT | FLAG_X_SAME if dx > 0 else FLAG_X_SHORT
+            xData.append(abs(dx))
+        else:
+            xData += struct.pack(">h", dx)
+
+        if dy == 0:
+            flag |= FLAG_Y_SAME
+        elif -255 <= dy <= 255:
+            flag |= FLAG_Y_SHORT | FLAG_Y_SAME if dy > 0 else FLAG_Y_SHORT
+            yData.append(abs(dy))
+        else:
+            yData += struct.pack(">h", dy)
+
+        if flag == lastFlag and repeat != 255:
+            repeat += 1
+            if repeat == 1:
+                flags.append(flag)
+            else:
+                flags[-2] = flag | FLAG_REPEAT
+                flags[-1] = repeat
+        else:
+            repeat = 0
+            flags.append(flag)
+        lastFlag = flag
+
+    header = struct.pack(">5h", len(polygons), *glyphBounds)
+    endPts = struct.pack(">{0}H".format(len(endPtsOfContours)), *endPtsOfContours)
+    # No instructions
+    return b"".join([header, endPts, b"\0\0", flags, xData, yData])
+
+COMPONENT_ARG_1_AND_2_ARE_WORDS = 0x0001
+COMPONENT_ARGS_ARE_XY_VALUES = 0x0002
+COMPONENT_MORE_COMPONENTS = 0x0020
+
+# Returns a record like the ones of the simple glyphs. The composite draws
+# exactly the pixels of its own bitmap, so the bounds are those of the bitmap.
+def compileRawComposite(components, records, glyphIDs, glyphBounds):
+    componentData = []
+    points = 0
+    contours = 0
+    for index, (baseName, dx, dy) in enumerate(components):
+        flags = ROUND_XY_TO_GRID | COMPONENT_ARGS_ARE_XY_VALUES
+        if index < len(components) - 1:
+            flags |= COMPONENT_MORE_COMPONENTS
+        if -128 <= dx <= 127 and -128 <= dy <= 127:
+            componentData.append(struct.pack(">HHbb", flags, glyphIDs[baseName], dx, dy))
+        else:
+            componentData.append(struct.pack(">HHhh", flags | COMPONENT_ARG_1_AND_2_ARE_WORDS, glyphIDs[baseName], dx, dy))
+        _, _, basePoints, baseContours = records[baseName]
+        points += basePoints
+        contours += baseContours
+
+    return [struct.pack(">5h", -1, *glyphBounds) + b"".join(componentData), glyphBounds, points, contours]
+
+@timed
+def makeRawTable_hmtx(ttf, advanceWidths):
+    bounds = ttf["glyf"].bounds
+    metrics = []
+    for glyphName in ttf.getGlyphOrder():
+        if glyphName == ".null":
+            metrics.append((0, 0))
+        elif glyphName in bounds:
+            metrics.append((advanceWidths[glyphName], bounds[glyphName][0]))
+        else:
+            metrics.append((advanceWidths[glyphName], 0))
+
+    # Trailing glyphs with the same advance width only store their lsb.
+    lastAdvance = metrics[-1][0]
+    numberOfHMetrics = len(metrics)
+    while metrics[numberOfHMetrics - 2][0] == lastAdvance:
+        numberOfHMetrics -= 1
+        if numberOfHMetrics <= 1:
+            numberOfHMetrics = 1
+            break
+
+    longMetrics = [value for metric in metrics[:numberOfHMetrics] for value in metric]
+    sideBearings = [metric[1] for metric in metrics[numberOfHMetrics:]]
+
+    hmtx = DefaultTable("hmtx")
+    hmtx.data = struct.pack(">" + "Hh" * numberOfHMetrics + "h" * len(sideBearings), *(longMetrics + sideBearings))
+    hmtx.metrics = dict(zip(ttf.getGlyphOrder(), metrics))
+    hmtx.numberOfHMetrics = numberOfHMetrics
+
+    ttf["hmtx"] = hmtx
+
+# Sets what fontTools would otherwise recalculate from the glyph outlines.
+@timed
+def recalcRawTables(ttf):
+    glyf = ttf["glyf"]
+    hmtx = ttf["hmtx"]
+    head = ttf["head"]
+    maxp = ttf["maxp"]
+    hhea = ttf["hhea"]
+    bounds = glyf.bounds
+
+    if bounds:
+        head.xMin = min(box[0] for box in bounds.values())
+        head.yMin = min(box[1] for box in bounds.values())
+        head.xMax = max(box[2] for box in bounds.values())
+        head.yMax = max(box[3] for box in bounds.values())
+    else:
+        head.xMin = head.yMin = head.xMax = head.yMax = 0
+    if all(hmtx.metrics[glyphName][1] == box[0] for glyphName, box in bounds.items()):
+        head.flags = head.flags | 0x2
+    else:
+        head.flags = head.flags & ~0x2
+    head.indexToLocFormat = glyf.indexToLocFormat
+
+    maxp.numGlyphs = len(ttf.getGlyphOrder())
+    maxp.maxPoints = glyf.maxPoints
+    maxp.maxContours = glyf.maxContours
+    maxp.maxCompositePoints = glyf.maxCompositePoints
+    maxp.maxCompositeContours = glyf.maxCompositeContours
+    maxp.maxComponentElements = glyf.maxComponentElements
+    maxp.maxComponentDepth = 1 if glyf.maxComponentElements > 0 else 0
+
+    hhea.numberOfHMetrics = hmtx.numberOfHMetrics
+    hhea.advanceWidthMax = max(advance for advance, _ in hmtx.metrics.values())
+    if bounds:
+        hhea.minLeftSideBearing = min(hmtx.metrics[glyphName][1] for glyphName in bounds)
+        hhea.minRightSideBearing = min(hmtx.metrics[glyphName][0] - hmtx.metrics[glyphName][1] - (box[2] - box[0]) for glyphName, box in bounds.items())
+        hhea.xMaxExtent = max(hmtx.metrics[glyphName][1] + box[2] - box[0] for glyphName, box in bounds.items())
+    else:
+        hhea.minLeftSideBearing = 0
+        hhea.minRightSideBearing = 0
+        hhea.xMaxExtent = 0
+
+    # Everything has been calculated already.
+    ttf.recalcBBoxes = False
+
+# BITMAP METRICS
+
+# The outlines trace the pixels exactly, so the bounds of every glyph follow
+# from its bitmap: OR-ing the rows gives the inked columns (the horizontal
+# extent), and the first and last inked rows give the vertical extent. Each
+# unique bitmap is measured once, and the bounds are handed to the glyf
+# records, the hmtx tables (the lsb is xMin) and through them to head and
+# hhea (see recalcRawTables), so no table scans the outline points again.
+# The OS/2 x-height and cap height are the tops of the "x" (0x78) and "H"
+# (0x48) glyphs, and the average width is that of all glyphs with a non-zero
+# advance width, as the OS/2 specification asks for.
+# The FontTools path (--no-fast-path) still recalculates head and hhea from
+# the outlines, so it keeps checking the bounds.
+
+# Returns the bounds of the ink in pixels [left, bottom, right, top], counted
+# from the bottom left corner of the cell, or None for an empty bitmap.
+def bitmapBounds(rows, width):
+    mask = (1 << width) - 1
+    columns = 0
+    top = None
+    for index, row in enumerate(rows):
+        row &= mask
+        if row != 0:
+            columns |= row
+            if top is None:
+                top = index
+            bottom = index
+    if columns == 0:
+        return None
+    right = (columns & -columns).bit_length() - 1
+    return [width - columns.bit_length(), len(rows) - 1 - bottom, width - right, len(rows) - top]
+
+# Returns {glyph name: (xMin, yMin, xMax, yMax) in font units or None}.
+@timed
+def measureGlyphs(glyphs, pixelSize, descent):
+    measured = dict()
+    bounds = dict()
+    for glyphName, glyph in glyphs.items():
+        key = (glyphWidth(glyph), tuple(glyph[0]))
+        if key not in measured:
+            box = bitmapBounds(glyph[0], key[0])
+            measured[key] = None if box is None else (box[0] * pixelSize, (box[1] - descent) * pixelSize, box[2] * pixelSize, (box[3] - descent) * pixelSize)
+        bounds[glyphName] = measured[key]
+    return bounds
+
+# Returns the metrics of makeTable_OS2(). The glyphs may have another name in
+# the font, given by renames (see TRUETYPE COLLECTIONS).
+def fontMetrics(ttf, glyphs, bounds, renames=None):
+    advanceWidths = [advance for advance, _ in ttf["hmtx"].metrics.values() if advance > 0]
+    averageWidth = (sum(advanceWidths) + len(advanceWidths) // 2) // len(advanceWidths) if advanceWidths else None
+    return [averageWidth, codePointTop(glyphs, bounds, 0x78, renames), codePointTop(glyphs, bounds, 0x48, renames)]
+
+def codePointTop(glyphs, bounds, code, renames=None):
+    renames = renames or dict()
+    for glyphName in glyphs:
+        if code in glyphs[glyphName][1]:
+            box = bounds.get(renames.get(glyphName, glyphName))
+            return box[3] if box is not None else None
+    return None
+
+# COMPOSITE GLYPHS
+
+# Many glyphs are copies of other glyphs moved within the cell (e.g. the 1/8
+# block elements or the box drawing lines), and in the C64 character ROM the
+# second half of each charset is the first half with the pixels inverted. With
+# composites enabled, such glyphs are stored as composite glyphs referring to
+# the outline of the other glyph instead of having an outline of their own:
+# - a moved copy is the other glyph with an offset,
+# - an inverted glyph is a solid cell with the (moved) other glyph cut out of
+#   it. The cell goes counter-clockwise, so with the nonzero winding rule the
+#   pixels covered by both are left empty. This is only done if the cut-out
+#   stays clear of the cell border, as monochrome rasterizers (with dropout
+#   control) turn on pixels along the edges the cell and the cut-out share.
+# Glyphs are compared trimmed to their ink, in glyph order, so every glyph
+# refers to the first glyph of its shape, which keeps its own outline.
+# Composite glyphs are not vectorized at all. Glyphs without unicodes (.notdef
+# etc.) never take part.
+
+def cellGlyphName(width, height):
+    return "cell.{0}x{1}".format(width, height)
+
+# The counter-clockwise outline of a whole cell.
+def cellPolygons(width, height, pixelSize, descent):
+    bottom = -descent * pixelSize
+    top = (height - descent) * pixelSize
+    return [[[0, bottom], [width * pixelSize, bottom], [width * pixelSize, top], [0, top]]]
+
+# Returns the rows trimmed to the ink and moved to the right, and the position
+# of the ink from the left and from the bottom of the cell (None if empty).
+def glyphShape(rows, width):
+    inked = [index for index, row in enumerate(rows) if row != 0]
+    if len(inked) == 0:
+        return None
+    columns = 0
+    for row in rows:
+        columns |= row
+    right = (columns & -columns).bit_length() - 1
+    trimmed = tuple(row >> right for row in rows[inked[0]:inked[-1] + 1])
+    return trimmed, width - columns.bit_length(), len(rows) - 1 - inked[-1]
+
+# True if the ink of a shape doesn't touch the border of the cell.
+def isInsideCell(shape, width, height):
+    trimmed, left, bottom = shape
+    inkWidth = max(row.bit_length() for row in trimmed)
+    return left > 0 and bottom > 0 and left + inkWidth < width and bottom + len(trimmed) < height
+
+# Returns the composite glyphs as {glyph name: [[base glyph, dx, dy], ...]} and
+# the cell glyphs they need, to be added to the glyphs.
+@timed
+def findCompositeGlyphs(glyphs, pixelSize):
+    composites = dict()
+    cells = dict()
+    shapes = dict()
+    for glyphName in makeGlyphOrder(glyphs):
+        glyph = glyphs[glyphName]
+        if len(glyph[1]) == 0:
+            continue
+        width = glyphWidth(glyph)
+        mask = (1 << width) - 1
+        rows = [row & mask for row in glyph[0]]
+        shape = glyphShape(rows, width)
+        if shape is None:
+            continue
+
+        if shape[0] in shapes:
+            baseName, left, bottom = shapes[shape[0]]
+            composites[glyphName] = [[baseName, (shape[1] - left) * pixelSize, (shape[2] - bottom) * pixelSize]]
+            continue
+
+        inverse = glyphShape([row ^ mask for row in rows], width)
+        if inverse is not None and inverse[0] in shapes and isInsideCell(inverse, width, len(rows)):
+            baseName, left, bottom = shapes[inverse[0]]
+            cellName = cellGlyphName(width, len(rows))
+            cells[cellName] = [[mask] * len(rows), [], width]
+            composites[glyphName] = [[cellName, 0, 0], [baseName, (inverse[1] - left) * pixelSize, (inverse[2] - bottom) * pixelSize]]
+            continue
+
+        shapes[shape[0]] = [glyphName, shape[1], shape[2]]
+    return composites, cells
+
+# EMBEDDED BITMAPS
+
+# At sizes where each pixel of the outlines covers a whole number of screen
+# pixels, the rendered glyphs are exactly the original bitmaps. These bitmaps
+# can be embedded as strikes (EBLC/EBDT) so that renderers blit them instead of
+# scan-converting the outlines. A strike of scale n has n screen pixels per
+# glyph pixel, e.g. 8, 16 and 24 ppem for 64C glyphs at the default pixel size.
+# Each glyph is stored as a bit-aligned image of its whole cell (image format
+# 5). Every run of consecutive glyphs of the same size gets one index subtable
+# with constant metrics (index format 2). Identical bitmaps share their image
+# data when the extra index subtables needed to point at it are smaller than a
+# copy of the image. Glyphs without any rows (.null etc.) are not in the strikes.
+
+STRIKE_SUBTABLE_SIZE = 28   # index subtable array entry + format 2 subtable
+
+@timed
+def makeRawTables_EBLC_EBDT(ttf, glyphs, strikes, pixelSize, descent, advanceWidths):
+    glyphOrder = ttf.getGlyphOrder()
+    cellHeight = max(len(glyphs[glyph][0]) for glyph in glyphs)
+    ebdtData = [struct.pack(">I", 0x00020000)]
+    ebdtSize = 4
+    strikeTables = []
+    if 2048 % pixelSize != 0:
+        # Otherwise the strike images wouldn't be the size of their ppem.
+        raise ValueError("Bitmap strikes need a pixel size that divides 2048 (not {0})".format(pixelSize))
+
+    for scale in strikes:
+        if scale < 1:
+            raise ValueError("Bitmap strike scales must be 1 or more")
+        ppem = scale * 2048 // pixelSize
+        # Each run is [first glyph, last glyph, image data offset, image size, metrics].
+        runs = []
+        images = dict()
+        for glyphID, glyphName in enumerate(glyphOrder):
+            glyph = glyphs[glyphName]
+            if len(glyph[0]) == 0:
+                continue
+            width = glyphWidth(glyph)
+            metrics = strikeGlyphMetrics(len(glyph[0]), width, scale, descent, round(advanceWidths[glyphName] * ppem / 2048))
+            key = glyphKey(glyph[0], width)
+            if key in images and images[key][1] > 2 * STRIKE_SUBTABLE_SIZE:
+                offset, imageSize = images[key]
+            else:
+                image = packStrikeImage(glyph[0], width, scale)
+                offset, imageSize = ebdtSize, len(image)
+                images.setdefault(key, [offset, imageSize])
+                ebdtData.append(image)
+                ebdtSize += imageSize
+            last = runs[-1] if runs else None
+            if last is not None and last[1] == glyphID - 1 and last[4] == metrics and last[2] + (glyphID - last[0]) * last[3] == offset:
+                last[1] = glyphID
+            else:
+                runs.append([glyphID, glyphID, offset, imageSize, metrics])
+        strikeTables.append([scale, ppem, runs])
+
+    # The index subtables of each strike follow the BitmapSize records.
+    eblcSizes = []
+    eblcIndexes = []
+    indexOffset = 8 + 48 * len(strikeTables)
+    for scale, ppem, runs in strikeTables:
+        arraySize = 8 * len(runs)
+        indexArray = [struct.pack(">HHI", run[0], run[1], arraySize + 20 * index) for index, run in enumerate(runs)]
+        indexSubTables = [struct.pack(">HHII", 2, 5, run[2], run[3]) + struct.pack(">BBbbBbbB", *run[4]) for run in runs]
+        indexTablesSize = arraySize + 20 * len(runs)
+
+        allMetrics = [run[4] for run in runs]
+        lineMetrics = struct.pack(">bbBbbbbbbbbb",
+                                  (cellHeight - descent) * scale,                              # ascender
+                                  -descent * scale,                                            # descender
+                                  max(metrics[4] for metrics in allMetrics),                   # widthMax
+                                  1, 0, 0,                                                     # caret slope and offset
+                                  min(metrics[2] for metrics in allMetrics),                   # minOriginSB
+                                  min(metrics[4] - metrics[2] - metrics[1] for metrics in allMetrics),  # minAdvanceSB
+                                  max(metrics[3] for metrics in allMetrics),                   # maxBeforeBL
+                                  min(metrics[3] - metrics[0] for metrics in allMetrics),      # minAfterBL
+                                  0, 0)
+        eblcSizes.append(struct.pack(">IIII", indexOffset, indexTablesSize, len(runs), 0) + lineMetrics + lineMetrics +
+                         struct.pack(">HHBBBB", runs[0][0], runs[-1][1], ppem, ppem, 1, 1))
+        eblcIndexes += indexArray + indexSubTables
+        indexOffset += indexTablesSize
+
+    eblc = DefaultTable("EBLC")
+    eblc.data = struct.pack(">II", 0x00020000, len(strikeTables)) + b"".join(eblcSizes + eblcIndexes)
+    ebdt = DefaultTable("EBDT")
+    ebdt.data = b"".join(ebdtData)
+
+    ttf["EBLC"] = eblc
+    ttf["EBDT"] = ebdt
+
+# Big glyph metrics: height, width, horizontal bearings and advance, vertical
+# bearings and advance. The image is the whole cell, with the bottom row at the
+# descent.
+def strikeGlyphMetrics(rows, width, scale, descent, advance):
+    metrics = [rows * scale, width * scale, 0, (rows - descent) * scale, advance, -(width * scale // 2), 0, rows * scale]
+    if max(metrics[0], metrics[1], metrics[4]) > 255 or not -128 <= metrics[3] <= 127:
+        raise ValueError("Bitmap strike scale {0} is too large for {1}x{2} glyphs".format(scale, width, rows))
+    return metrics
+
+# Each pixel becomes scale x scale pixels. The rows are packed without padding
+# (bit-aligned), only the whole image is padded to a byte. The rows are scaled
+# a byte at a time.
+def packStrikeImage(glyphData, width, scale):
+    scaledBytes = scaledByteTable(scale)
+    rowPadding = -width % 8
+    rowBits = width * scale
+    bits = 0
+    for row in glyphData:
+        paddedRow = (row & ((1 << width) - 1)) << rowPadding
+        scaledRow = 0
+        for shift in range(width + rowPadding - 8, -1, -8):
+            scaledRow = (scaledRow << (8 * scale)) | scaledBytes[(paddedRow >> shift) & 0xff]
+        scaledRow >>= rowPadding * scale
+        for _ in range(scale):
+            bits = (bits << rowBits) | scaledRow
+    size = len(glyphData) * scale * rowBits
+    padding = -size % 8
+    return (bits << padding).to_bytes((size + padding) // 8, "big")
+
+@functools.lru_cache(maxsize=None)
+def scaledByteTable(scale):
+    pixelMask = (1 << scale) - 1
+    table = []
+    for value in range(256):
+        scaled = 0
+        for x in range(7, -1, -1):
+            scaled = (scaled << scale) | (pixelMask if (value >> x) & 1 else 0)
+        table.append(scaled)
+    return table
+
+# OUTPUT FORMATS
+
+# The same font can be written as TTF, TTX, WOFF and WOFF2 (the latter only
+# with the brotli module installed). The tables are compiled once and every
+# binary format is written from the compiled data, so fontTools doesn't compile
+# them again for each file. Each format is written on its own thread; most of
+# the time goes into zlib and brotli, which release the GIL.
+# With a single format the output file name is used as it is, otherwise each
+# format replaces the extension of the output file name with its own.
+
+OUTPUT_FORMATS = ["ttf", "ttx", "woff", "woff2", "ttc"]
+
+# Returns a list of [format, output file name].
+def outputFileNames(outputFileName, formats):
+    if len(formats) == 1:
+        return [[formats[0], outputFileName]]
+    if not isinstance(outputFileName, str):
+        raise ValueError("Several output formats need an output file name")
+    stem = os.path.splitext(outputFileName)[0]
+    return [[format, stem + "." + format] for format in formats]
+
+# Returns the compiled data of every table. The tables are compiled in the
+# same order as TTFont.save() does, so the tables a table depends on (e.g. glyf
+# for loca) are compiled first.
+def compileTables(ttf):
+    tableData = dict()
+    for tag in ttf.keys()[1:]:  # skip GlyphOrder
+        compileTable(ttf, tag, tableData)
+    return tableData
+
+def compileTable(ttf, tag, tableData):
+    if tag in tableData:
+        return
+    for dependency in getTableClass(tag).dependencies:
+        if dependency in ttf:
+            compileTable(ttf, dependency, tableData)
+    tableData[tag] = ttf.getTableData(tag)
+
+def decompileTables(ttf, tableData, tags):
+    for tag in tags:
+        table = newTable(tag)
+        table.decompile(tableData[tag], ttf)
+        ttf[tag] = table
+
+@timed
+def writeFonts(ttf, tableData, outputs):
+    if len(outputs) == 1:
+        writeFont(ttf, tableData, *outputs[0])
+        return
+    with ThreadPoolExecutor(max_workers=len(outputs)) as executor:
+        for future in [executor.submit(writeFont, ttf, tableData, format, fileName) for format, fileName in outputs]:
+            future.result()
+
+# The TTX output is written from the font itself as it needs the decompiled
+# tables, the binary formats from a font made of the compiled tables.
+def writeFont(ttf, tableData, format, outputFileName):
+    if format == "ttx":
+        with stage("TTFont.saveXML"):
+            ttf.saveXML(outputFileName)
+        return
+    compiled = compiledFont(tableData, format)
+    # Separate stage names as the formats are written at the same time.
+    with stage("TTFont.save" if format == "ttf" else "TTFont.save." + format):
+        compiled.save(outputFileName)
+
+def compiledFont(tableData, format="ttf"):
+    compiled = TTFont(recalcBBoxes=False, recalcTimestamp=False, flavor=None if format == "ttf" else format)
+    for tag in tableData:
+        compiled[tag] = DefaultTable(tag)
+        compiled[tag].data = tableData[tag]
+    return compiled
+
+# TRUETYPE COLLECTIONS
+
+# Several faces (e.g. the uppercase and the lowercase charset) can be written
+# to one .ttc file. The glyphs of all faces are merged into a single glyph set,
+# so the glyf, loca, hmtx, head, hhea, maxp and post tables (and the strikes)
+# are vectorized, built and compiled once and stored once in the file. Only
+# the OS/2, cmap and name tables are built for each face. Glyphs with the same
+# bitmap in several faces become one glyph, named as in the first face (e.g.
+# the --add-all glyphs at 0xEE00 and 0xEF00). Glyphs without unicodes (.notdef
+# etc.) are only merged by name. Where a name is already taken by another
+# bitmap, the glyph gets the face number as a suffix ("A.1").
+
+COLLECTION_FACE_TABLES = ["OS/2", "cmap", "name"]
+
+# Returns the merged glyphs and for each face the glyphs it has renamed.
+def mergeFaceGlyphs(faceGlyphs):
+    glyphs = dict()
+    index = dict()
+    renames = []
+    for faceNumber, face in enumerate(faceGlyphs):
+        faceRenames = dict()
+        for glyphName, glyph in face.items():
+            key = glyphKey(glyph[0], glyphWidth(glyph))
+            name = index.get(key, glyphName) if len(glyph[1]) > 0 else glyphName
+            if name in glyphs and glyphKey(glyphs[name][0], glyphWidth(glyphs[name])) != key:
+                name = "{0}.{1}".format(glyphName, faceNumber)
+            if name != glyphName:
+                faceRenames[glyphName] = name
+            if len(glyph[1]) > 0:
+                index.setdefault(key, name)
+            if name in glyphs:
+                glyphs[name][1] += [code for code in glyph[1] if code not in glyphs[name][1]]
+            else:
+                glyphs[name] = [glyph[0], list(glyph[1])] + glyph[2:]
+        renames.append(faceRenames)
+    return glyphs, renames
+
+# Each face is [glyphs, font name].
+@timed
+@garbageCollectionPaused()
+def saveCollection(faces, outputFileName, pixelSize, descent, copyrightYear, creator, version, cache=None, fastPath=True, workers=None, strikes=None, composites=False):
+    f = TTFont()
+
+    if cache is None:
+        cache = GlyphCache()
+
+    glyphs, renames = mergeFaceGlyphs([face[0] for face in faces])
+    log.info("Collection: {0} faces sharing {1} glyphs (of {2})".format(len(faces), len(glyphs), sum(len(face[0]) for face in faces)))
+
+    compositeGlyphs = dict()
+    cells = dict()
+    if composites:
+        compositeGlyphs, cells = findCompositeGlyphs(glyphs, pixelSize)
+        glyphs = dict(glyphs, **cells)
+        log.info("Composite glyphs: {0} of {1} glyphs".format(len(compositeGlyphs), len(glyphs)))
+
+    cellWidth, cellHeight, bounds = makeGlyphTables(f, glyphs, pixelSize, descent, cache, fastPath, workers, dict(), compositeGlyphs, cells, strikes)
+    makeTable_post(f, pixelSize, descent)
+    with stage("compile"):
+        sharedTableData = compileTables(f)
+
+    collection = TTCollection()
+    for (faceGlyphs, fontName), faceRenames in zip(faces, renames):
+        unicodes = [code for glyph in faceGlyphs for code in faceGlyphs[glyph][1]]
+        makeTable_OS2(f, pixelSize, descent, min(unicodes), max(unicodes), cellWidth, cellHeight, fontMetrics(f, faceGlyphs, bounds, faceRenames))
+        makeTable_cmap(f, faceGlyphs, faceRenames)
+        makeTable_name(f, fontName, "Regular", copyrightYear, creator, version)
+        tableData = dict(sharedTableData)
+        with stage("compile"):
+            for tag in COLLECTION_FACE_TABLES:
+                compileTable(f, tag, tableData)
+        collection.fonts.append(compiledFont(tableData))
+
+    # Tables with the same data are only written once.
+    with stage("TTCollection.save"):
+        collection.save(outputFileName, shareTables=True)
+
+# INCREMENTAL REBUILD
+
+# With a state file next to the output, a rebuild only vectorizes and packs the
+# glyphs whose bitmaps changed since the previous build. The state file holds
+# the bitmap and the compiled glyf record of every glyph, as well as the
+# compiled OS/2, cmap, name and post tables, which are reused as long as the
+# glyph names, code points and font options stay the same. head, hhea and maxp
+# depend on every glyph and are rebuilt each time (they're tiny).
+# Without a file name the state is only kept in memory (for --watch).
+
+STATE_SUFFIX = ".c64ttf-state"
+STATE_FORMAT = 1
+STATIC_TABLES = ["OS/2", "cmap", "name", "post"]
+STATE_TABLE_SETS = 16             # Sets of static tables kept in memory
+
+# Only the static tables of the last build are saved, but a few more sets are
+# kept in memory for builds alternating between fonts (see JOB MANIFESTS).
+class BuildState:
+    def __init__(self, fileName):
+        self.fileName = fileName
+        self.outlines = None
+        self.glyphs = dict()
+        self.tableSets = OrderedDict()
+        self.keys = dict()
+        self.reusedGlyphs = 0
+        self.reusedTables = 0
+        if fileName is None:
+            return
+        try:
+            with open(fileName) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if state.get("format") != STATE_FORMAT:
+            return
+
+        self.outlines = state["outlines"]
+        self.glyphs = {glyphName: [bytes.fromhex(key), [base64.b64decode(data), bounds, points, contours]] for glyphName, [key, data, bounds, points, contours] in state["glyphs"].items()}
+        self.tableSets[state["signature"]] = {tag: base64.b64decode(data) for tag, data in state["tables"].items()}
+
+    # Returns the glyf records of the glyphs that are the same as last time.
+    @timed
+    def unchangedRecords(self, glyphs, pixelSize, descent):
+        self.keys = {glyphName: glyphKey(glyphs[glyphName][0], glyphWidth(glyphs[glyphName])) for glyphName in glyphs}
+        if self.outlines != [pixelSize, descent]:
+            return dict()
+        records = {glyphName: self.glyphs[glyphName][1] for glyphName, key in self.keys.items() if glyphName in self.glyphs and self.glyphs[glyphName][0] == key}
+        self.reusedGlyphs += len(records)
+        return records
+
+    def staticTables(self, signature):
+        tables = self.tableSets.get(signature)
+        if tables is None or any(tag not in tables for tag in STATIC_TABLES):
+            return None
+        self.tableSets.move_to_end(signature)
+        self.reusedTables += 1
+        return tables
+
+    @timed
+    def update(self, pixelSize, descent, records, signature, tables):
+        self.outlines = [pixelSize, descent]
+        self.glyphs = {glyphName: [self.keys[glyphName], record] for glyphName, record in records.items()}
+        self.tableSets[signature] = tables
+        self.tableSets.move_to_end(signature)
+        if len(self.tableSets) > STATE_TABLE_SETS:
+            self.tableSets.popitem(last=False)
+        if self.fileName is None:
+            return
+
+        state = {"format": STATE_FORMAT,
+                 "outlines": self.outlines,
+                 "glyphs": {glyphName: [self.keys[glyphName].hex(), base64.b64encode(data).decode("ascii"), bounds, points, contours]
+                            for glyphName, [data, bounds, points, contours] in records.items()},
+                 "signature": signature,
+                 "tables": {tag: base64.b64encode(data).decode("ascii") for tag, data in tables.items()}}
+        # Written to a temporary file first so an interrupted build never
+        # leaves a broken state file behind.
+        with open(self.fileName + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.fileName + ".tmp", self.fileName)
+
+# Everything the OS/2, cmap, name and post tables are built from.
+def staticTableSignature(glyphOrder, glyphs, pixelSize, descent, fontName, copyrightYear, creator, version, cellWidth, cellHeight, metrics):
+    inputs = [glyphOrder, [glyphs[glyphName][1] for glyphName in glyphOrder if glyphName in glyphs],
+              pixelSize, descent, fontName, copyrightYear, creator, version, cellWidth, cellHeight, metrics]
+    return hashlib.sha1(json.dumps(inputs).encode("utf-8")).hexdigest()
+
 # MAIN METHODS
 
+@timed
 def readCharBitmaps(fileName):
     if fileName is None:
         return []
 
-    print("Processing input file {0}...".format(fileName))
-    data = open(fileName, "rb").read()
+    log.info("Processing input file {0}...".format(fileName))
+    return parseCharBitmaps(open(fileName, "rb").read())
 
+def parseCharBitmaps(data):
     # Shave off magic bytes and append zeroes so the length of the remaining
     # data is an integer multiple of 8.
-    data = data[2:]
-    while len(data) % 8 != 0:
-        data.append(0)
+    data = bytes(data[2:])
+    if len(data) % 8 != 0:
+        data += bytes(8 - len(data) % 8)
 
     if len(data) == 0:
-        print("No data found. ")
+        log.warning("No data found. ")
         return []
     elif len(data) > 2048:
-        print("More than 256 chars detected. Are you sure this is a C64 character set???")
+        log.warning("More than 256 chars detected. Are you sure this is a C64 character set???")
         return []
     else:
-        print("{0} glyphs loaded...".format(int(len(data) / 8)))
+        log.info("{0} glyphs loaded...".format(int(len(data) / 8)))
         return [data[idx:idx + 8] for idx in range(0, len(data), 8)]
 
+@timed
 def mapGlyphs(glyphData, charset):
     return {char[1] : [glyphData[char[0]], char[2]] for char in charset if char[0] < len(glyphData)}
 
-def mapAllGlyphs(existingGlyphs, newGlyphBitmaps, unicodeOffset):
-    newGlyphs = {"uni{0}".format(hex(unicodeOffset + index).upper()[2:]) : [data, [unicodeOffset + index]] for index, data in enumerate(newGlyphBitmaps)}
+# Glyphs with a bitmap identical to an existing glyph are merged into that
+# glyph (the first one wins) rather than being added again. The index maps
+# bitmap bytes to glyph names; pass the same index to consecutive calls to
+# avoid rebuilding it.
+@timed
+def mapAllGlyphs(existingGlyphs, newGlyphBitmaps, unicodeOffset, index=None):
+    if index is None:
+        index = indexGlyphBitmaps(existingGlyphs)
     updates = {}
-
-    for newGlyph in newGlyphs:
-        newBitmap = newGlyphs[newGlyph][0]
-        newUnicodes = newGlyphs[newGlyph][1]
-        foundGlyph = False
-        for oldGlyph in existingGlyphs:
-            oldBitmap = existingGlyphs[oldGlyph][0]
-            oldUnicodes = existingGlyphs[oldGlyph][1]
-            if oldBitmap == newBitmap:
-                if oldGlyph in updates:
-                    updates[oldGlyph] = [oldBitmap, list(set(updates[oldGlyph][1] + newUnicodes))]
-                else:
-                    updates[oldGlyph] = [oldBitmap, list(set(oldUnicodes + newUnicodes))]
-                foundGlyph = True
-                break
-        if not foundGlyph:
-            updates[newGlyph] = newGlyphs[newGlyph]
-
-    return updates    
-
-def processCharFiles(lowercaseInputFileName, uppercaseInputFileName, outputFileName, asXML, addMissingASCII, addMissingDanish, pixelSize, descent, addAll, fontName, copyrightYear, creator, version):
+    addedGlyphs = []
+
+    for offset, newBitmap in enumerate(newGlyphBitmaps):
+        unicode = unicodeOffset + offset
+        oldGlyph = index.get(bytes(newBitmap))
+        if oldGlyph is None:
+            newGlyph = "uni{0}".format(hex(unicode).upper()[2:])
+            updates[newGlyph] = [newBitmap, [unicode]]
+            addedGlyphs.append(newGlyph)
+        else:
+            if oldGlyph not in updates:
+                updates[oldGlyph] = [existingGlyphs[oldGlyph][0], list(existingGlyphs[oldGlyph][1])]
+            unicodes = updates[oldGlyph][1]
+            if unicode not in unicodes:
+                unicodes.append(unicode)
+
+    # New glyphs only become candidates for later calls, not for this one.
+    for newGlyph in addedGlyphs:
+        index.setdefault(bytes(updates[newGlyph][0]), newGlyph)
+
+    return updates
+
+# Special glyphs without any unicodes (.notdef etc.) never take part.
+def indexGlyphBitmaps(glyphs):
+    index = dict()
+    for glyph in glyphs:
+        if len(glyphs[glyph][1]) > 0:
+            index.setdefault(bytes(glyphs[glyph][0]), glyph)
+    return index
+
+def processCharFiles(lowercaseInputFileName, uppercaseInputFileName, outputFileName, asXML, addMissingASCII, addMissingDanish, pixelSize, descent, addAll, fontName, copyrightYear, creator, version, cache=None, fastPath=True, workers=None, state=None, formats=None, strikes=None, composites=False, subset=None):
+    uppercaseBitmaps = readCharBitmaps(uppercaseInputFileName)
+    lowercaseBitmaps = readCharBitmaps(lowercaseInputFileName)
+    if formats == ["ttc"]:
+        faces = makeCharsetFaces(lowercaseBitmaps, uppercaseBitmaps, addMissingASCII, addMissingDanish, addAll, fontName)
+        if subset is not None:
+            faces = [[subsetGlyphs(faceGlyphs, subset), faceName] for faceGlyphs, faceName in faces]
+        saveCollection(faces, outputFileName, pixelSize, descent, copyrightYear, creator, version, cache, fastPath, workers, strikes, composites)
+        return
+    glyphs = makeGlyphs(lowercaseBitmaps, uppercaseBitmaps, addMissingASCII, addMissingDanish, addAll)
+    if subset is not None:
+        glyphs = subsetGlyphs(glyphs, subset)
+    saveFont(glyphs, outputFileName, asXML, pixelSize, descent, fontName, copyrightYear, creator, version, cache, fastPath, workers, state, formats, strikes, composites)
+
+# In a collection the uppercase and the lowercase charset are separate faces,
+# the lowercase one named "<font name> Lowercase" if there are both.
+def makeCharsetFaces(lowercaseBitmaps, uppercaseBitmaps, addMissingASCII, addMissingDanish, addAll, fontName):
+    faces = []
+    if len(uppercaseBitmaps) > 0:
+        faces.append([makeGlyphs([], uppercaseBitmaps, addMissingASCII, addMissingDanish, addAll), fontName])
+    if len(lowercaseBitmaps) > 0:
+        faces.append([makeGlyphs(lowercaseBitmaps, [], addMissingASCII, addMissingDanish, addAll), fontName + " Lowercase" if len(faces) > 0 else fontName])
+    return faces
+
+@timed
+def makeGlyphs(lowercaseBitmaps, uppercaseBitmaps, addMissingASCII, addMissingDanish, addAll):
     glyphs = makeEmptyGlyphs()
-    lowercaseBitmaps = []
-    uppercaseBitmaps = []
-
-    if uppercaseInputFileName is not None:
-        uppercaseBitmaps = readCharBitmaps(uppercaseInputFileName)
-        glyphs.update(mapGlyphs(uppercaseBitmaps, CHAR_HI))
-    
-    if lowercaseInputFileName is not None:
-        lowercaseBitmaps = readCharBitmaps(lowercaseInputFileName)
-        glyphs.update(mapGlyphs(lowercaseBitmaps, CHAR_LO))
+    glyphs.update(mapGlyphs(uppercaseBitmaps, CHAR_HI))
+    glyphs.update(mapGlyphs(lowercaseBitmaps, CHAR_LO))
 
     if addMissingASCII:
         glyphs.update(makeMissingASCII())
@@ -1015,26 +2372,1167 @@ def processCharFiles(lowercaseInputFileName, uppercaseInputFileName, outputFileN
         glyphs.update(makeMissingDanishChars())
 
     if addAll:
-        glyphs.update(mapAllGlyphs(glyphs, uppercaseBitmaps, 0xee00))
-        glyphs.update(mapAllGlyphs(glyphs, lowercaseBitmaps, 0xef00))
-
-    saveFont(glyphs, outputFileName, asXML, pixelSize, descent, fontName, copyrightYear, creator, version)
+        index = indexGlyphBitmaps(glyphs)
+        glyphs.update(mapAllGlyphs(glyphs, uppercaseBitmaps, 0xee00, index))
+        glyphs.update(mapAllGlyphs(glyphs, lowercaseBitmaps, 0xef00, index))
+
+    return glyphs
+
+# SUBSETTING
+
+# A font for a web page only needs the glyphs of the text on that page. The
+# subset is a set of code points, taken from text and/or a stream of PETSCII
+# bytes. Glyphs without any of those code points are dropped before anything
+# is vectorized, and the glyphs that are kept lose the code points outside the
+# subset, so the cmap and post tables only cover the subset as well. Glyphs
+# without unicodes (.notdef etc.) are always kept.
+
+# Control characters (line breaks, tabs) never need a glyph.
+def textCodePoints(text):
+    return {ord(char) for char in text if unicodedata.category(char) != "Cc"}
+
+# The printable PETSCII codes as [first code, last code, first screen code].
+# Screen codes are the indices into the charsets.
+PETSCII_SCREEN_CODES = [[0x20, 0x3f, 0x20], [0x40, 0x5f, 0x00], [0x60, 0x7f, 0x40],
+                        [0xa0, 0xbf, 0x60], [0xc0, 0xfe, 0x40], [0xff, 0xff, 0x5e]]
+PETSCII_LOWERCASE = 0x0e
+PETSCII_UPPERCASE = 0x8e
+PETSCII_REVERSE_ON = 0x12
+PETSCII_REVERSE_OFF = [0x92, 0x0d, 0x8d]
+
+@functools.lru_cache(maxsize=None)
+def petsciiScreenCode(code):
+    for first, last, screenCode in PETSCII_SCREEN_CODES:
+        if first <= code <= last:
+            return screenCode + code - first
+    return None
+
+# The stream starts in uppercase mode like the C64 does and follows the charset
+# switches and reverse on/off codes. Each character needs the code points of
+# CHAR_HI or CHAR_LO and its code point in the --add-all range (0xEE00 for the
+# uppercase charset, 0xEF00 for the lowercase one).
+def petsciiCodePoints(data):
+    lowercase = False
+    reverse = False
+    screenCodes = set()
+    for code in data:
+        if code == PETSCII_LOWERCASE:
+            lowercase = True
+        elif code == PETSCII_UPPERCASE:
+            lowercase = False
+        elif code == PETSCII_REVERSE_ON:
+            reverse = True
+        elif code in PETSCII_REVERSE_OFF:
+            reverse = False
+        elif petsciiScreenCode(code) is not None:
+            screenCodes.add((lowercase, petsciiScreenCode(code) | (0x80 if reverse else 0)))
+
+    charsetUnicodes = [{char[0]: char[2] for char in charset} for charset in [CHAR_HI, CHAR_LO]]
+    codePoints = set()
+    for lowercase, screenCode in screenCodes:
+        codePoints.update(charsetUnicodes[lowercase].get(screenCode, []))
+        codePoints.add((0xef00 if lowercase else 0xee00) + screenCode)
+    return codePoints
+
+# Returns the subset of the given text and the text and PETSCII files, or None
+# if there are none of them.
+def readSubset(text=None, textFileName=None, petsciiFileName=None):
+    if text is None and textFileName is None and petsciiFileName is None:
+        return None
+    codePoints = set()
+    if text is not None:
+        codePoints.update(textCodePoints(text))
+    if textFileName is not None:
+        with open(textFileName, encoding="utf-8") as f:
+            codePoints.update(textCodePoints(f.read()))
+    if petsciiFileName is not None:
+        with open(petsciiFileName, "rb") as f:
+            codePoints.update(petsciiCodePoints(f.read()))
+    return frozenset(codePoints)
+
+@timed
+def subsetGlyphs(glyphs, subset):
+    keptGlyphs = dict()
+    codePoints = set()
+    for glyph in glyphs:
+        unicodes = glyphs[glyph][1]
+        keptUnicodes = [code for code in unicodes if code in subset]
+        if len(unicodes) == 0 or len(keptUnicodes) > 0:
+            keptGlyphs[glyph] = [glyphs[glyph][0], keptUnicodes] + glyphs[glyph][2:]
+            codePoints.update(keptUnicodes)
+    if len(codePoints) == 0:
+        raise ValueError("None of the code points of the subset are in the font")
+    log.info("Subset: {0} of {1} glyphs, {2} of {3} code points in the font".format(len(keptGlyphs), len(glyphs), len(codePoints), len(subset)))
+    return keptGlyphs
+
+# BITMAP FONT INPUT
+
+# Besides 64C files, whole bitmap fonts can be converted. Both GNU Unifont .hex
+# files and BDF files are supported. Glyphs can be of any size (including
+# mixed widths, e.g. 8x16 and 16x16 in Unifont) and are named after their code
+# point. The tallest glyph sets the height of the em square.
+
+def unicodeGlyphName(unicode):
+    if unicode <= 0xffff:
+        return "uni{0:04X}".format(unicode)
+    return "u{0:X}".format(unicode)
+
+# Each line is "CODEPOINT:HEXDATA" where the hex data is the rows of the glyph
+# (top row first). The width follows from the length of the hex data, as all
+# glyphs have the given height (16 pixels in Unifont).
+@timed
+def readHexFont(fileName, height=16):
+    log.info("Processing input file {0}...".format(fileName))
+    glyphs = dict()
+    with open(fileName, "r") as f:
+        for lineNumber, line in enumerate(f, 1):
+            line = line.strip()
+            if len(line) == 0 or line.startswith("#"):
+                continue
+            code, _, data = line.partition(":")
+            digitsPerRow = len(data) // height
+            if digitsPerRow == 0 or len(data) % height != 0:
+                raise ValueError("{0}:{1}: glyph data doesn't fit a height of {2} pixels".format(fileName, lineNumber, height))
+            unicode = int(code, 16)
+            rows = [int(data[idx:idx + digitsPerRow], 16) for idx in range(0, len(data), digitsPerRow)]
+            glyphs[unicodeGlyphName(unicode)] = [rows, [unicode], digitsPerRow * 4]
+    log.info("{0} glyphs loaded...".format(len(glyphs)))
+    return glyphs
+
+# Glyphs are placed in a cell the size of the font bounding box, so glyphs
+# with a smaller bounding box keep their position relative to the baseline.
+# Returns the glyphs and the descent (below baseline) in pixels.
+@timed
+def readBDFFont(fileName):
+    log.info("Processing input file {0}...".format(fileName))
+    glyphs = dict()
+    fontWidth, fontHeight, fontX, fontY = 8, 8, 0, 0
+    unicode = -1
+    width = 0
+    box = None
+    rows = None
+
+    with open(fileName, "r", encoding="latin1") as f:
+        for line in f:
+            words = line.split()
+            if len(words) == 0:
+                continue
+            keyword = words[0]
+            if rows is not None:
+                if keyword == "ENDCHAR":
+                    if unicode >= 0:
+                        glyphs[unicodeGlyphName(unicode)] = [placeBDFGlyph(rows, box, width, fontHeight, fontX, fontY), [unicode], width]
+                    rows = None
+                else:
+                    rows.append(int(keyword, 16))
+            elif keyword == "FONTBOUNDINGBOX":
+                fontWidth, fontHeight, fontX, fontY = [int(word) for word in words[1:5]]
+            elif keyword == "STARTCHAR":
+                unicode = -1
+                width = fontWidth
+                box = [fontWidth, fontHeight, fontX, fontY]
+            elif keyword == "ENCODING":
+                unicode = int(words[1])
+            elif keyword == "DWIDTH":
+                width = max(int(words[1]), 1)
+            elif keyword == "BBX":
+                box = [int(word) for word in words[1:5]]
+            elif keyword == "BITMAP":
+                rows = []
+
+    log.info("{0} glyphs loaded...".format(len(glyphs)))
+    return glyphs, max(-fontY, 0)
+
+def placeBDFGlyph(rows, box, width, fontHeight, fontX, fontY):
+    boxWidth, boxHeight, boxX, boxY = box
+    padding = (boxWidth + 7) // 8 * 8 - boxWidth
+    shift = boxX - fontX
+    top = (fontY + fontHeight) - (boxY + boxHeight)
+    cell = [0] * fontHeight
+    for index, row in enumerate(rows[:boxHeight]):
+        y = top + index
+        if 0 <= y < fontHeight:
+            row >>= padding
+            # Move the row to its place within the glyph width.
+            offset = width - boxWidth - shift
+            cell[y] = (row << offset if offset >= 0 else row >> -offset) & ((1 << width) - 1)
+    return cell
+
+def processBitmapFont(inputFileName, outputFileName, asXML, pixelSize, descent, fontName, copyrightYear, creator, version, cache=None, fastPath=True, hexHeight=16, workers=None, state=None, formats=None, strikes=None, composites=False, subset=None):
+    if inputFileName.lower().endswith(".bdf"):
+        fontGlyphs, fontDescent = readBDFFont(inputFileName)
+    else:
+        fontGlyphs, fontDescent = readHexFont(inputFileName, hexHeight), 2
+    if descent is None:
+        descent = fontDescent
 
-# "static void main()"
-if __name__ == "__main__":
+    glyphs = makeEmptyGlyphs()
+    glyphs.update(fontGlyphs)
+    if subset is not None:
+        glyphs = subsetGlyphs(glyphs, subset)
+
+    # Scale the font to fill the em square by default.
+    if pixelSize is None:
+        pixelSize = 2048 // max(len(glyphs[glyph][0]) for glyph in glyphs)
+    if formats == ["ttc"]:
+        saveCollection([[glyphs, fontName]], outputFileName, pixelSize, descent, copyrightYear, creator, version, cache, fastPath, workers, strikes, composites)
+        return
+    saveFont(glyphs, outputFileName, asXML, pixelSize, descent, fontName, copyrightYear, creator, version, cache, fastPath, workers, state, formats, strikes, composites)
+
+# LIBRARY API
+
+# Converts 64C data (bytes, bytearray or memoryview including the two byte load
+# address) without touching the disk. If output is a binary file-like object
+# the font is written to it, otherwise the font is returned as bytes. A subset
+# is a set of code points (see SUBSETTING).
+def convertCharsets(lowercase=None, uppercase=None, output=None, asXML=False, addMissingASCII=False, addMissingDanish=False, pixelSize=256, descent=1, addAll=False, fontName="C64", copyrightYear=None, creator=None, version="1.00", cache=None, fastPath=True, workers=None, strikes=None, composites=False, subset=None):
+    if lowercase is None and uppercase is None:
+        raise ValueError("No input data")
+
+    if copyrightYear is None:
+        copyrightYear = date.today().year
+    if creator is None:
+        creator = getpass.getuser()
+
+    lowercaseBitmaps = parseCharBitmaps(lowercase) if lowercase is not None else []
+    uppercaseBitmaps = parseCharBitmaps(uppercase) if uppercase is not None else []
+    glyphs = makeGlyphs(lowercaseBitmaps, uppercaseBitmaps, addMissingASCII, addMissingDanish, addAll)
+    if subset is not None:
+        glyphs = subsetGlyphs(glyphs, subset)
+
+    if output is not None:
+        saveFont(glyphs, output, asXML, pixelSize, descent, fontName, copyrightYear, creator, version, cache, fastPath, workers, strikes=strikes, composites=composites)
+        return None
+
+    buffer = io.BytesIO()
+    saveFont(glyphs, buffer, asXML, pixelSize, descent, fontName, copyrightYear, creator, version, cache, fastPath, workers, strikes=strikes, composites=composites)
+    return buffer.getvalue()
+
+# BATCH CONVERSION
+
+# A batch source is either a directory (all 64C files in it), a glob pattern
+# or a JSON manifest. Files are paired into fonts by their names: "foo_lower.64c"
+# and "foo_upper.64c" (or "-lo"/"-hi" etc.) become the font "foo". Files
+# without such a suffix are treated as an uppercase/graphics set on their own.
+# A manifest is a JSON list of objects with the keys "lowercase", "uppercase",
+# "output" and "name" (all optional except one of the input files).
+# Each job is a list [lowercase file, uppercase file, output file, font name].
+# A batch source can also be a zip or tar archive (see below), in which case
+# the jobs carry the charset data instead of file names.
+
+BATCH_LOWERCASE_SUFFIXES = ["lower", "lowercase", "lo"]
+BATCH_UPPERCASE_SUFFIXES = ["upper", "uppercase", "hi"]
+
+def findBatchJobs(source, outputDir, fontName, asXML):
+    extension = ".ttx" if asXML else ".ttf"
+
+    if isArchive(source):
+        if source.lower().endswith(".zip"):
+            yield from findZipJobs(source, outputDir, fontName, extension)
+        else:
+            yield from findTarJobs(source, outputDir, fontName, extension)
+        return
+
+    if source.lower().endswith(".json") and os.path.isfile(source):
+        baseDir = os.path.dirname(source)
+        for lowercase, uppercase, output, name in manifestJobs(json.load(open(source)), outputDir, fontName, extension):
+            if lowercase is not None:
+                lowercase = os.path.join(baseDir, lowercase)
+            if uppercase is not None:
+                uppercase = os.path.join(baseDir, uppercase)
+            yield [lowercase, uppercase, output, name]
+        return
+
+    if os.path.isdir(source):
+        fileNames = [entry.path for entry in os.scandir(source) if entry.is_file() and entry.name.lower().endswith(".64c")]
+    else:
+        fileNames = glob.glob(source)
+
+    for stem, lowercase, uppercase in pairCharFiles(fileNames):
+        name = fontName or stem
+        yield [lowercase, uppercase, os.path.join(outputDir, stem + extension), name]
+
+def manifestJobs(entries, outputDir, fontName, extension):
+    for index, entry in enumerate(entries):
+        name = entry.get("name", fontName or "C64-{0}".format(index))
+        output = os.path.join(outputDir, entry.get("output", name + extension))
+        yield [entry.get("lowercase"), entry.get("uppercase"), output, name]
+
+def pairCharFiles(fileNames):
+    pairs = dict()
+    for fileName in sorted(fileNames):
+        stem, slot = splitCharFileName(fileName)
+        if stem in pairs and pairs[stem][slot] is not None:
+            # Two candidates for the same slot; keep the second one as a separate font.
+            stem = os.path.splitext(os.path.basename(fileName))[0]
+        pairs.setdefault(stem, [None, None])[slot] = fileName
+    return [[stem, pair[0], pair[1]] for stem, pair in pairs.items()]
+
+# Returns the font stem and the slot (0 = lowercase, 1 = uppercase) of a file.
+def splitCharFileName(fileName):
+    stem = os.path.splitext(os.path.basename(fileName))[0]
+    for slot, suffixes in enumerate([BATCH_LOWERCASE_SUFFIXES, BATCH_UPPERCASE_SUFFIXES]):
+        for suffix in suffixes:
+            for separator in "_-. ":
+                if stem.lower().endswith(separator + suffix):
+                    return stem[:-len(separator + suffix)], slot
+    return stem, 1
+
+# Archives are read member by member while the jobs are running, so only the
+# charsets of the jobs in flight are held in memory. The members of a zip
+# archive are paired by name up front and read when their job is due. A tar
+# archive can only be read in order, so each member waits until its partner
+# turns up (usually right after it); members without a partner are converted
+# on their own at the end. A JSON manifest in the archive is used instead of
+# pairing by name; in a tar archive it has to be the first member.
+
+ARCHIVE_EXTENSIONS = [".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz"]
+
+def isArchive(source):
+    return os.path.isfile(source) and any(source.lower().endswith(extension) for extension in ARCHIVE_EXTENSIONS)
+
+def findZipJobs(source, outputDir, fontName, extension):
+    with zipfile.ZipFile(source) as archive:
+        memberNames = [info.filename for info in archive.infolist() if not info.is_dir()]
+        manifests = [memberName for memberName in memberNames if memberName.lower().endswith(".json")]
+        if len(manifests) > 0:
+            jobs = manifestJobs(json.loads(archive.read(manifests[0])), outputDir, fontName, extension)
+        else:
+            charFiles = [memberName for memberName in memberNames if memberName.lower().endswith(".64c")]
+            jobs = [[lowercase, uppercase, os.path.join(outputDir, stem + extension), fontName or stem] for stem, lowercase, uppercase in pairCharFiles(charFiles)]
+        for lowercase, uppercase, output, name in jobs:
+            yield [readZipMember(archive, lowercase), readZipMember(archive, uppercase), output, name]
+
+# A missing member is replaced by the error, which fails its job when it is
+# read (rather than reading a local file of the same name).
+def readZipMember(archive, memberName):
+    if memberName is None:
+        return None
+    try:
+        return archive.read(memberName)
+    except KeyError:
+        return missingMemberError(memberName)
+
+def missingMemberError(memberName):
+    return FileNotFoundError("{0} is not in the archive".format(memberName))
+
+def findTarJobs(source, outputDir, fontName, extension):
+    manifest = None
+    waiting = dict()
+    first = True
+    with tarfile.open(source, "r|*") as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            memberName = member.name
+            if memberName.lower().endswith(".json") and first:
+                manifest = TarManifest(manifestJobs(json.loads(archive.extractfile(member).read()), outputDir, fontName, extension))
+            elif manifest is not None:
+                yield from manifest.add(memberName, archive.extractfile(member).read())
+            elif memberName.lower().endswith(".64c"):
+                stem, slot = splitCharFileName(memberName)
+                if stem in waiting and waiting[stem][slot] is not None:
+                    stem = os.path.splitext(os.path.basename(memberName))[0]
+                pair = waiting.setdefault(stem, [None, None])
+                pair[slot] = archive.extractfile(member).read()
+                if pair[0] is not None and pair[1] is not None:
+                    del waiting[stem]
+                    yield [pair[0], pair[1], os.path.join(outputDir, stem + extension), fontName or stem]
+            first = False
+
+    for stem, pair in waiting.items():
+        yield [pair[0], pair[1], os.path.join(outputDir, stem + extension), fontName or stem]
+    if manifest is not None:
+        yield from manifest.remaining()
+
+# Holds on to the members of a tar archive until all jobs needing them are due.
+class TarManifest:
+    def __init__(self, jobs):
+        self.jobs = list(jobs)
+        self.missing = [set(memberName for memberName in job[:2] if memberName is not None) for job in self.jobs]
+        self.users = dict()
+        for index, job in enumerate(self.jobs):
+            for memberName in self.missing[index]:
+                self.users.setdefault(memberName, []).append(index)
+        self.members = dict()
+
+    def add(self, memberName, data):
+        if memberName not in self.users:
+            return
+        self.members[memberName] = data
+        for index in self.users[memberName]:
+            self.missing[index].discard(memberName)
+            if len(self.missing[index]) == 0:
+                yield self.makeJob(index)
+
+    def makeJob(self, index):
+        lowercase, uppercase, output, name = self.jobs[index]
+        job = [self.member(lowercase), self.member(uppercase), output, name]
+        for memberName in [lowercase, uppercase]:
+            if memberName in self.users:
+                self.users[memberName].remove(index)
+                if len(self.users[memberName]) == 0:
+                    del self.users[memberName]
+                    self.members.pop(memberName, None)
+        return job
+
+    def member(self, memberName):
+        if memberName is None:
+            return None
+        if memberName not in self.members:
+            return missingMemberError(memberName)
+        return self.members[memberName]
+
+    # Jobs with members missing from the archive. These fail when they are run.
+    def remaining(self):
+        for index in range(len(self.jobs)):
+            if len(self.missing[index]) > 0:
+                yield self.makeJob(index)
+
+# The cache lives for the lifetime of each worker process so that glyphs shared
+# between the fonts converted by that worker are only vectorized once.
+batchCache = None
+
+def initBatchWorker(cacheDir):
+    global batchCache
+    batchCache = GlyphCache(cacheDir=cacheDir)
+
+# Returns [job, error, seconds, font data]. The font data is only returned
+# (instead of written to the output file) with returnData.
+def convertBatchJob(job, options, outputDir, returnData=False):
+    lowercase, uppercase, outputFileName, fontName = job
+    start = time.time()
+    try:
+        data = None
+        checkBatchOutput(outputFileName, outputDir)
+        if not returnData and os.path.dirname(outputFileName) != "":
+            os.makedirs(os.path.dirname(outputFileName), exist_ok=True)
+        if returnData or isinstance(lowercase, (bytes, Exception)) or isinstance(uppercase, (bytes, Exception)):
+            data = convertCharsets(readBatchInput(lowercase), readBatchInput(uppercase), None if returnData else outputFileName, fontName=fontName, cache=batchCache, **options)
+        else:
+            processCharFiles(lowercase, uppercase, outputFileName, fontName=fontName, cache=batchCache, **options)
+        batchCache.commit()
+        return [job, None, time.time() - start, data]
+    except Exception as e:
+        return [job, "{0}: {1}".format(type(e).__name__, e), time.time() - start, None]
+
+# Manifests name their own output files, which must not end up outside the
+# output directory (or outside the output zip file, for an empty outputDir).
+def checkBatchOutput(outputFileName, outputDir):
+    root = os.path.abspath(outputDir or os.curdir)
+    path = os.path.abspath(outputFileName)
+    if (os.path.isabs(outputFileName) and not os.path.isabs(outputDir)) or path == root or os.path.commonpath([root, path]) != root:
+        raise ValueError("Output file {0} is outside the output directory".format(outputFileName))
+
+# Job inputs are file names or (from archives) the data itself, or the error
+# for a member missing from the archive.
+def readBatchInput(input):
+    if isinstance(input, Exception):
+        raise input
+    if input is None or isinstance(input, bytes):
+        return input
+    with open(input, "rb") as f:
+        return f.read()
+
+# Runs the jobs on a process pool and yields the result of convertBatchJob()
+# for each job as soon as it is done. Only a bounded number of jobs are in
+# flight at any time so huge batches never end up queued in memory all at once.
+def runBatch(jobs, options, outputDir, workers=None, cacheDir=None, returnData=False):
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=initBatchWorker, initargs=(cacheDir,)) as executor:
+        pending = set()
+        for job in jobs:
+            pending.add(executor.submit(convertBatchJob, job, options, outputDir, returnData))
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+# With outputZip, the fonts are written into that zip file instead of the
+# output directory.
+def processBatch(source, outputDir, options, fontName=None, workers=None, cacheDir=None, outputZip=None):
+    if outputZip is not None:
+        archive = zipfile.ZipFile(outputZip, "w", zipfile.ZIP_DEFLATED)
+        outputDir = ""
+    else:
+        archive = None
+        os.makedirs(outputDir, exist_ok=True)
+    jobs = findBatchJobs(source, outputDir, fontName, options["asXML"])
+    converted = 0
+    failed = 0
+    start = time.time()
+
+    for job, error, seconds, data in runBatch(jobs, options, outputDir, workers, cacheDir, archive is not None):
+        if error is None:
+            converted += 1
+            if archive is not None:
+                archive.writestr(job[2], data)
+            print("OK    {0} ({1:.3f} s)".format(job[2], seconds))
+        else:
+            failed += 1
+            print("ERROR {0}: {1}".format(job[2], error))
+
+    if archive is not None:
+        archive.close()
+
+    elapsed = time.time() - start
+    rate = converted / elapsed if elapsed > 0 else 0.0
+    print("Converted {0} fonts ({1} failed) in {2:.2f} s ({3:.1f} fonts/s)".format(converted, failed, elapsed, rate))
+    return failed == 0
+
+# JOB MANIFESTS
+
+# A job manifest lists many fonts built from the same inputs, e.g. several
+# sizes or names of one charset. Each font is an object with the long command
+# line options as keys ("lowercase", "uppercase", "output", "name", "pixelsize",
+# "add-missing-ascii", ...), except those of the whole run (JOB_RUN_OPTIONS).
+# Options missing from a font are taken from the "defaults" object of the
+# manifest and then from the command line. Input files are relative to the
+# manifest, output files to the output directory (and must stay inside it).
+# The manifest is JSON, or TOML (a [defaults] table and a [[fonts]] array) on
+# Python 3.11 and later:
+#
+# {"defaults": {"lowercase": "c64_lower.64c", "uppercase": "c64_upper.64c"},
+#  "fonts": [{"name": "C64", "add-all": true},
+#            {"name": "C64 Small", "pixelsize": 128, "output": "small.ttf"}]}
+#
+# The fonts are built in stages so that shared work is only done once:
+# 1) every input file is read once,
+# 2) every unique bitmap is vectorized once in pixel units (pixel size 1, no
+#    descent). Scaling those contours gives exactly the contours vectorizing at
+#    each font's own size would give,
+# 3) fonts with the same glyphs, pixel size and descent share an in-memory
+#    BuildState, so their glyf records are only compiled once and the OS/2,
+#    cmap, name and post tables are only rebuilt when their inputs differ.
+# Fonts with the format "ttc" and the same output file are built as the faces
+# of one collection (see TRUETYPE COLLECTIONS), which takes the pixel size,
+# descent and the other options of its first face.
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+def readJobManifest(fileName):
+    if fileName.lower().endswith(".toml"):
+        if tomllib is None:
+            raise ValueError("TOML job manifests need Python 3.11 or later")
+        with open(fileName, "rb") as f:
+            manifest = tomllib.load(f)
+    else:
+        with open(fileName) as f:
+            manifest = json.load(f)
+    if isinstance(manifest, list):
+        manifest = {"fonts": manifest}
+    return manifest.get("defaults", dict()), manifest.get("fonts", [])
+
+# Options of the whole run (modes, instrumentation, workers etc.) which can't
+# be set per font.
+JOB_RUN_OPTIONS = ["font", "hex_height", "batch", "jobs", "output_zip", "scan", "output_dir", "watch", "serve", "workers",
+                   "edge_engine", "incremental", "cache_dir", "cache_stats", "timings", "timings_memory", "profile"]
+
+# Returns the command line arguments with the options of a job applied.
+def jobArgs(args, defaults, font, baseDir, outputDir):
+    values = dict(vars(args))
+    for key, value in list(defaults.items()) + list(font.items()):
+        dest = key.replace("-", "_")
+        if dest not in values or dest in JOB_RUN_OPTIONS:
+            raise ValueError("Unknown option in job manifest: " + key)
+        values[dest] = value
+    manifestDests = {key.replace("-", "_") for key in list(defaults) + list(font)}
+    for dest in ["lowercase", "uppercase", "subset_file", "subset_petscii"]:
+        if values[dest] is not None and dest in manifestDests:
+            values[dest] = os.path.join(baseDir, values[dest])
+    if values["name"] is None:
+        values["name"] = "C64"
+    if values["output"] is None:
+        values["output"] = values["name"] + "." + formatsFromArgs(argparse.Namespace(**values))[0]
+    values["output"] = os.path.join(outputDir, values["output"])
+    return argparse.Namespace(**values)
+
+# Jobs with the same inputs, glyph options and subset have the same glyphs.
+def jobGlyphSet(job, options):
+    return (job.lowercase, job.uppercase, options["addMissingASCII"], options["addMissingDanish"], options["addAll"], options["subset"])
+
+def scaleContours(contours, pixelSize, descent):
+    return [[[point[0] * pixelSize, (point[1] - descent) * pixelSize] for point in polygon] for polygon in contours]
+
+def processJobs(fileName, args, outputDir=".", cache=None, workers=None):
+    start = time.time()
+    if cache is None:
+        cache = GlyphCache()
+    defaults, fonts = readJobManifest(fileName)
+    jobs = [jobArgs(args, defaults, font, os.path.dirname(fileName), outputDir) for font in fonts]
+
+    # 1) Read every input file once. Only the fonts using an input that can't
+    # be read (or glyphs that can't be made) fail.
+    inputs = dict()
+    inputErrors = dict()
+    references = 0
+    for job in jobs:
+        for inputFileName in [job.lowercase, job.uppercase]:
+            if inputFileName is not None:
+                references += 1
+                if inputFileName not in inputs and inputFileName not in inputErrors:
+                    try:
+                        inputs[inputFileName] = readCharBitmaps(inputFileName)
+                    except Exception as e:
+                        inputErrors[inputFileName] = "{0}: {1}".format(type(e).__name__, e)
+
+    glyphSets = dict()
+    glyphSetErrors = dict()
+    for job in jobs:
+        glyphSet = jobGlyphSet(job, optionsFromArgs(job))
+        if glyphSet in glyphSets or glyphSet in glyphSetErrors:
+            continue
+        errors = [inputErrors[inputFileName] for inputFileName in [job.lowercase, job.uppercase] if inputFileName in inputErrors]
+        if len(errors) > 0:
+            glyphSetErrors[glyphSet] = errors[0]
+            continue
+        try:
+            glyphs = makeGlyphs(inputs.get(job.lowercase, []), inputs.get(job.uppercase, []), *glyphSet[2:5])
+            if glyphSet[5] is not None:
+                glyphs = subsetGlyphs(glyphs, glyphSet[5])
+        except Exception as e:
+            glyphSetErrors[glyphSet] = "{0}: {1}".format(type(e).__name__, e)
+            continue
+        glyphSets[glyphSet] = glyphs
+
+    # 2) Vectorize every unique bitmap once in pixel units.
+    bitmaps = dict()
+    for glyphs in glyphSets.values():
+        for glyph in glyphs.values():
+            bitmaps.setdefault(glyphKey(glyph[0], glyphWidth(glyph)), [glyph[0], glyphWidth(glyph)])
+    unitContours = dict(zip(bitmaps, cache.vectorizeAll(list(bitmaps.values()), 1, 0, workers)))
+
+    # 3) Build the fonts, sharing the compiled glyphs and tables.
+    states = dict()
+    collections = OrderedDict()
+    glyphCount = 0
+    failed = 0
+    for job in jobs:
+        if formatsFromArgs(job) == ["ttc"]:
+            collections.setdefault(job.output, []).append(job)
+            continue
+        options = optionsFromArgs(job)
+        glyphSet = jobGlyphSet(job, options)
+        if glyphSet in glyphSetErrors:
+            failed += 1
+            print("ERROR {0}: {1}".format(job.output, glyphSetErrors[glyphSet]))
+            continue
+        glyphs = glyphSets[glyphSet]
+        pixelSize = options["pixelSize"]
+        descent = options["descent"]
+        group = glyphSet + (pixelSize, descent)
+        glyphCount += len(glyphs)
+
+        # The first font of a group gets its contours from a cache holding the
+        # scaled contours of its glyphs; the others reuse the compiled records.
+        if group not in states:
+            states[group] = BuildState(None)
+        groupCache = GlyphCache(maxSize=len(glyphs))
+        for glyph in glyphs.values():
+            key = glyphKey(glyph[0], glyphWidth(glyph))
+            groupCache.remember((key, pixelSize, descent), scaleContours(unitContours[key], pixelSize, descent))
+
+        state = states[group]
+        fontStart = time.time()
+        try:
+            checkBatchOutput(job.output, outputDir)
+            if os.path.dirname(job.output) != "":
+                os.makedirs(os.path.dirname(job.output), exist_ok=True)
+            saveFont(glyphs, job.output, options["asXML"], pixelSize, descent, job.name, options["copyrightYear"], options["creator"], options["version"], groupCache, options["fastPath"], workers, state, formatsFromArgs(job), options["strikes"], options["composites"])
+        except Exception as e:
+            failed += 1
+            print("ERROR {0}: {1}: {2}".format(job.output, type(e).__name__, e))
+            continue
+        print("OK    {0} ({1:.3f} s)".format(job.output, time.time() - fontStart))
+
+    sharedGlyphs = 0
+    for output, faceJobs in collections.items():
+        options = optionsFromArgs(faceJobs[0])
+        pixelSize = options["pixelSize"]
+        descent = options["descent"]
+        errors = [glyphSetErrors[glyphSet] for glyphSet in [jobGlyphSet(job, optionsFromArgs(job)) for job in faceJobs] if glyphSet in glyphSetErrors]
+        if len(errors) > 0:
+            failed += len(faceJobs)
+            print("ERROR {0}: {1}".format(output, errors[0]))
+            continue
+        faces = []
+        for job in faceJobs:
+            faces.append([glyphSets[jobGlyphSet(job, optionsFromArgs(job))], job.name])
+        glyphs = mergeFaceGlyphs([face[0] for face in faces])[0]
+        glyphCount += sum(len(face[0]) for face in faces)
+        sharedGlyphs += sum(len(face[0]) for face in faces) - len(glyphs)
+
+        groupCache = GlyphCache(maxSize=len(glyphs))
+        for glyph in glyphs.values():
+            key = glyphKey(glyph[0], glyphWidth(glyph))
+            groupCache.remember((key, pixelSize, descent), scaleContours(unitContours[key], pixelSize, descent))
+
+        fontStart = time.time()
+        try:
+            checkBatchOutput(output, outputDir)
+            if os.path.dirname(output) != "":
+                os.makedirs(os.path.dirname(output), exist_ok=True)
+            saveCollection(faces, output, pixelSize, descent, options["copyrightYear"], options["creator"], options["version"], groupCache, options["fastPath"], workers, options["strikes"], options["composites"])
+        except Exception as e:
+            failed += len(faceJobs)
+            print("ERROR {0}: {1}: {2}".format(output, type(e).__name__, e))
+            continue
+        print("OK    {0} ({1} faces, {2:.3f} s)".format(output, len(faceJobs), time.time() - fontStart))
+
+    reusedGlyphs = sum(state.reusedGlyphs for state in states.values()) + sharedGlyphs
+    reusedTables = sum(state.reusedTables for state in states.values())
+    print("Built {0} fonts ({1} failed) in {2:.2f} s".format(len(jobs) - failed, failed, time.time() - start))
+    print("  Input files read:   {0} for {1} uses".format(len(inputs), references))
+    print("  Bitmaps vectorized: {0} for {1} glyphs".format(len(unitContours), glyphCount))
+    print("  Glyphs compiled:    {0} for {1} glyphs".format(glyphCount - reusedGlyphs, glyphCount))
+    print("  Static tables:      built for {0} of {1} fonts".format(len(jobs) - failed - reusedTables, len(jobs) - failed))
+    return failed == 0
+
+# CHARSET SCANNER
+
+# Finds charsets in VICE snapshots (the 64 KB of C64 RAM), .prg and .64c files,
+# .d64 disk images (every PRG file on the disk) and other files, which are taken
+# to be memory dumps starting at address 0. The VIC-II can only fetch a charset
+# from a 2 KB aligned address, so only those 2 KB windows are scored. The files
+# are memory-mapped and scored in place; only the PRG files on a D64 image are
+# put together from their sectors, and only the charsets found are copied.
+#
+# A window is scored by how many of the letters and digits (their positions are
+# taken from CHAR_HI) look like glyphs: some but not too many pixels set, and
+# each row mostly the same as the next one. The space glyph must be empty.
+# Windows where many letters have two empty top rows are lowercase charsets.
+# An uppercase and a lowercase charset next to each other become one font,
+# just like in the character ROM.
+
+SCAN_WINDOW = 0x800
+SCAN_MIN_SCORE = 0.75
+SCAN_MIN_INK = 6                  # Set pixels per glyph
+SCAN_MAX_INK = 40
+SCAN_MIN_SAME = 38                # Pixels equal to the pixel below (of 56)
+SCAN_MIN_LOWERCASE = 8            # Letters with two empty top rows
+
+SCAN_SPACE = [index for index, name, _ in CHAR_HI if name == "space"][0]
+SCAN_LETTERS = [index for index, name, _ in CHAR_HI if len(name) == 1 and "A" <= name <= "Z"]
+SCAN_GLYPHS = SCAN_LETTERS + [index for index, name, _ in CHAR_HI if name in ["zero", "one", "two", "three", "four", "five", "six", "seven", "eight", "nine"]]
+
+VICE_SNAPSHOT_MAGIC = b"VICE Snapshot File\x1a"
+VICE_RAM_OFFSET = 16 + 1 + 1 + 4 + 4   # Module name, version, size, CPU port and cartridge lines
+
+D64_SECTORS = [21] * 17 + [19] * 7 + [18] * 6 + [17] * 10    # Tracks 1-40
+D64_FILE_TYPE_PRG = 2
+
+# Yields [source, address, lowercase, uppercase] for each charset (or pair of
+# charsets) found, where lowercase and uppercase are 64C data or None.
+def scanCharsets(fileName):
+    if os.path.getsize(fileName) == 0:
+        return
+    with open(fileName, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        for source, address, memory, start, end in memoryImages(fileName, data):
+            yield from pairCharsets(findCharsets(source, address, memory, start, end))
+
+# Yields [source, address, data, start, end] where data[start:end] is memory
+# starting at the given address.
+def memoryImages(fileName, data):
+    extension = os.path.splitext(fileName)[1].lower()
+    if data[:len(VICE_SNAPSHOT_MAGIC)] == VICE_SNAPSHOT_MAGIC:
+        module = data.find(b"C64MEM")
+        if module >= 0:
+            start = module + VICE_RAM_OFFSET
+            yield ["ram", 0, data, start, min(start + 0x10000, len(data))]
+    elif extension == ".d64":
+        for name, fileData in readD64Files(data):
+            if len(fileData) > 2:
+                yield [name, fileData[0] | fileData[1] << 8, fileData, 2, len(fileData)]
+    elif extension in [".prg", ".64c"] and len(data) > 2:
+        yield ["", data[0] | data[1] << 8, data, 2, len(data)]
+    else:
+        yield ["", 0, data, 0, len(data)]
+
+def d64Offset(track, sector):
+    if track < 1 or track > len(D64_SECTORS) or sector >= D64_SECTORS[track - 1]:
+        return None
+    return (sum(D64_SECTORS[:track - 1]) + sector) * 256
+
+# Each sector starts with the track and sector of the next one. In the last
+# sector of a file, the "sector" is the index of the last byte used instead.
+def readD64Sectors(data, track, sector):
+    seen = set()
+    while track != 0 and (track, sector) not in seen:
+        offset = d64Offset(track, sector)
+        if offset is None or offset + 256 > len(data):
+            return
+        seen.add((track, sector))
+        yield offset
+        track, sector = data[offset], data[offset + 1]
+
+def readD64Files(data):
+    for directory in readD64Sectors(data, 18, 1):
+        for entry in range(directory, directory + 256, 32):
+            if data[entry + 2] & 0x07 != D64_FILE_TYPE_PRG:
+                continue
+            name = data[entry + 5:entry + 21].rstrip(b"\xa0").decode("latin-1")
+            chunks = []
+            for offset in readD64Sectors(data, data[entry + 3], data[entry + 4]):
+                last = data[offset + 1] + 1 if data[offset] == 0 else 256
+                chunks.append(data[offset + 2:offset + last])
+            yield name, b"".join(chunks)
+
+# Yields [source, address, is lowercase, score, 64C data] for each window that
+# looks like a charset.
+def findCharsets(source, address, data, start, end):
+    first = start + (-address) % SCAN_WINDOW
+    for offset in range(first, end - SCAN_WINDOW + 1, SCAN_WINDOW):
+        score = scoreCharset(data, offset)
+        if score >= SCAN_MIN_SCORE:
+            windowAddress = address + offset - start
+            yield [source, windowAddress, isLowercaseCharset(data, offset), score, struct.pack("<H", windowAddress & 0xffff) + data[offset:offset + SCAN_WINDOW]]
+
+def scoreCharset(data, offset):
+    space = offset + SCAN_SPACE * 8
+    if any(data[space:space + 8]):
+        return 0.0
+    glyphs = 0
+    for index in SCAN_GLYPHS:
+        rows = data[offset + index * 8:offset + index * 8 + 8]
+        ink = sum(bin(row).count("1") for row in rows)
+        same = sum(8 - bin(row ^ below).count("1") for row, below in zip(rows, rows[1:]))
+        if SCAN_MIN_INK <= ink <= SCAN_MAX_INK and same >= SCAN_MIN_SAME:
+            glyphs += 1
+    return glyphs / len(SCAN_GLYPHS)
+
+def isLowercaseCharset(data, offset):
+    emptyTops = sum(1 for index in SCAN_LETTERS if data[offset + index * 8] == 0 and data[offset + index * 8 + 1] == 0)
+    return emptyTops >= SCAN_MIN_LOWERCASE
+
+def pairCharsets(hits):
+    pending = None
+    for hit in hits:
+        if pending is not None and hit[0] == pending[0] and hit[1] == pending[1] + SCAN_WINDOW and hit[2] != pending[2]:
+            lowercase, uppercase = (hit, pending) if hit[2] else (pending, hit)
+            yield [pending[0], pending[1], lowercase[4], uppercase[4]]
+            pending = None
+            continue
+        if pending is not None:
+            yield unpairedCharset(pending)
+        pending = hit
+    if pending is not None:
+        yield unpairedCharset(pending)
+
+def unpairedCharset(hit):
+    return [hit[0], hit[1], hit[4] if hit[2] else None, None if hit[2] else hit[4]]
+
+# Files with the same name (e.g. a/game.prg and b/game.prg) can give the same
+# font names; later ones get a number appended.
+def processScan(fileNames, outputDir, options, fontName=None, cache=None):
+    os.makedirs(outputDir, exist_ok=True)
+    extension = ".ttx" if options["asXML"] else ".ttf"
+    names = set()
+    converted = 0
+    failed = 0
+    start = time.time()
+
+    for fileName in fileNames:
+        stem = os.path.splitext(os.path.basename(fileName))[0]
+        try:
+            hits = list(scanCharsets(fileName))
+        except Exception as e:
+            failed += 1
+            print("ERROR {0}: {1}: {2}".format(fileName, type(e).__name__, e))
+            continue
+        for source, address, lowercase, uppercase in hits:
+            parts = [stem]
+            if len(source) > 0:
+                parts.append(re.sub(r"[^A-Za-z0-9]+", "-", source).strip("-"))
+            parts.append("{0:04x}".format(address))
+            name = "_".join(parts)
+            number = 1
+            while name.lower() in names:
+                number += 1
+                name = "_".join(parts + [str(number)])
+            names.add(name.lower())
+            outputFileName = os.path.join(outputDir, name + extension)
+            try:
+                convertCharsets(lowercase, uppercase, outputFileName, fontName=fontName or name, cache=cache, **options)
+            except Exception as e:
+                failed += 1
+                print("ERROR {0}: {1}: {2}".format(outputFileName, type(e).__name__, e))
+                continue
+            converted += 1
+            kinds = [kind for kind, charset in [["uppercase", uppercase], ["lowercase", lowercase]] if charset is not None]
+            print("FOUND {0} ({1} at ${2:04x})".format(outputFileName, " + ".join(kinds), address))
+
+    print("Converted {0} fonts ({1} failed) from {2} files in {3:.2f} s".format(converted, failed, len(fileNames), time.time() - start))
+    return converted > 0 and failed == 0
+
+# CONVERSION SERVER
+
+# Keeps fontTools loaded and converts charsets sent over HTTP on localhost.
+# POST /convert with a JSON object:
+#   {"lowercase": <base64 64C data>, "uppercase": <base64 64C data>,
+#    "args": ["-m", "-a", "-n", "My Font", ...]}
+# where "args" are the usual command line options (file options are ignored,
+# but "--subset-text" can be used).
+# The response body is the TTF (or TTX with "-x") file.
+# GET /stats returns the request count and latency percentiles as JSON.
+
+SERVER_LATENCY_WINDOW = 10000
+
+class ConversionServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cacheDir=None):
+        super().__init__(address, ConversionRequestHandler)
+        self.parser = makeArgumentParser()
+        self.cache = GlyphCache(cacheDir=cacheDir)
+        self.latencies = deque(maxlen=SERVER_LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def convert(self, request):
+        args = self.parser.parse_args([str(arg) for arg in request.get("args", [])])
+        if args.format is not None:
+            raise ValueError("-t isn't supported by the conversion server (use -x for TTX output)")
+        args.subset_file = None
+        args.subset_petscii = None
+        lowercase = base64.b64decode(request["lowercase"]) if request.get("lowercase") else None
+        uppercase = base64.b64decode(request["uppercase"]) if request.get("uppercase") else None
+
+        return convertCharsets(lowercase, uppercase, fontName=args.name or "C64", cache=self.cache, **optionsFromArgs(args))
+
+    def record(self, seconds, failed):
+        with self.lock:
+            self.requests += 1
+            if failed:
+                self.errors += 1
+            self.latencies.append(seconds)
+
+    def stats(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            stats = {"requests": self.requests, "errors": self.errors}
+        for percentile in [50, 90, 99]:
+            value = latencies[min(len(latencies) - 1, len(latencies) * percentile // 100)] if latencies else 0.0
+            stats["p{0}_ms".format(percentile)] = round(value * 1000, 3)
+        return stats
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != "/convert":
+            self.send_error(404)
+            return
+
+        start = time.time()
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            body = self.server.convert(request)
+        except (Exception, SystemExit) as e:
+            # argparse exits on invalid options
+            self.server.record(time.time() - start, True)
+            # The message goes into the (escaped) body, not the status line.
+            self.send_error(400, "Bad Request", "{0}: {1}".format(type(e).__name__, e))
+            return
+
+        self.server.record(time.time() - start, False)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/stats":
+            self.send_error(404)
+            return
+
+        body = json.dumps(self.server.stats()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def serve(port, cacheDir=None):
+    server = ConversionServer(("127.0.0.1", port), cacheDir)
+    print("Listening on http://127.0.0.1:{0}/convert ...".format(port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.cache.close()
+        print("Served {requests} requests ({errors} failed), latency p50 {p50_ms} ms, p90 {p90_ms} ms, p99 {p99_ms} ms".format(**server.stats()))
+
+# WATCH MODE
+
+# Rebuilds the font whenever one of the input files changes. Editors often save
+# a file in several steps, so a rebuild only starts once the files have been
+# left alone for WATCH_DEBOUNCE seconds. On Linux the changes are reported by
+# inotify, elsewhere the files are polled.
+# Everything stays loaded between rebuilds: fontTools, the glyph cache and the
+# compiled glyphs and tables of the previous build (see INCREMENTAL REBUILD).
+
+WATCH_DEBOUNCE = 0.02
+WATCH_POLL_INTERVAL = 0.1
+
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+
+class FileWatcher:
+    def __init__(self, fileNames):
+        self.fileNames = [os.path.abspath(fileName) for fileName in fileNames]
+        self.fd = None
+        self.directories = dict()
+        self.snapshot = self.stat()
+        if sys.platform.startswith("linux"):
+            try:
+                self.startInotify()
+            except (OSError, AttributeError):
+                self.fd = None
+
+    # The directories are watched rather than the files themselves, as many
+    # editors save by writing a new file and renaming it over the old one.
+    def startInotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        for directory in set(os.path.dirname(fileName) for fileName in self.fileNames):
+            wd = libc.inotify_add_watch(fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed for " + directory)
+            self.directories[wd] = directory
+        self.fd = fd
+
+    # Blocks until the files changed and then stayed unchanged for a while.
+    def wait(self):
+        self.waitForChange(None)
+        while self.waitForChange(WATCH_DEBOUNCE):
+            pass
+
+    # Returns True if any of the files changed within timeout seconds (None
+    # waits forever).
+    def waitForChange(self, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            if self.fd is not None:
+                ready, _, _ = select.select([self.fd], [], [], remaining)
+                if len(ready) > 0 and self.readInotifyEvents():
+                    return True
+            else:
+                time.sleep(WATCH_POLL_INTERVAL if remaining is None else min(WATCH_POLL_INTERVAL, remaining))
+                snapshot = self.stat()
+                if snapshot != self.snapshot:
+                    self.snapshot = snapshot
+                    return True
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+    # Each event is struct inotify_event: wd, mask, cookie, len, name[len].
+    def readInotifyEvents(self):
+        data = os.read(self.fd, 65536)
+        changed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = struct.unpack_from("iIII", data, offset)
+            name = os.fsdecode(data[offset + 16:offset + 16 + length].rstrip(b"\0"))
+            offset += 16 + length
+            if os.path.join(self.directories.get(wd, ""), name) in self.fileNames:
+                changed = True
+        return changed
+
+    def stat(self):
+        snapshot = []
+        for fileName in self.fileNames:
+            try:
+                info = os.stat(fileName)
+                snapshot.append((info.st_mtime_ns, info.st_size))
+            except OSError:
+                snapshot.append(None)
+        return snapshot
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+def watchAndRebuild(fileNames, build):
+    watcher = FileWatcher(fileNames)
+    print("Watching {0} for changes{1}, press Ctrl+C to stop...".format(", ".join(fileNames), "" if watcher.fd is not None else " (polling)"))
+    try:
+        while True:
+            watcher.wait()
+            start = time.perf_counter()
+            try:
+                build()
+            except Exception as e:
+                print("Rebuild failed: {0}: {1}".format(type(e).__name__, e))
+                continue
+            print("Rebuilt in {0:.1f} ms".format((time.perf_counter() - start) * 1000))
+    except KeyboardInterrupt:
+        print("")
+    finally:
+        watcher.close()
+
+def positiveInt(value):
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid int value: '{0}'".format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be 1 or more, not {0}".format(number))
+    return number
+
+def makeArgumentParser():
     parser = argparse.ArgumentParser(description="c64ttf.py v1.4 - C64 Character Set to TrueType Converter (c) 2013-20 atbrask")
-    
+
     # Files
     parser.add_argument("-l", "--lowercase", help="Input 64C file with lowercase and uppercase characters.")
     parser.add_argument("-u", "--uppercase", help="Input 64C file with uppercase and graphics characters.")
+    parser.add_argument("-f", "--font", help="Input bitmap font (BDF or GNU Unifont .hex file) instead of 64C files")
+    parser.add_argument("--hex-height", help="Glyph height in .hex files (default is 16)", type=int, default=16)
     parser.add_argument("-o", "--output", help="Output filename (default is font name + '.TTF' or '.TTX')")
+    parser.add_argument("-b", "--batch", help="Convert every charset in a directory, glob pattern, JSON manifest or zip/tar archive")
+    parser.add_argument("-j", "--jobs", help="Build all fonts listed in a JSON (or TOML) job manifest, sharing the work between them")
+    parser.add_argument("--output-zip", help="Write the fonts of a batch conversion into this zip file instead of the output directory")
+    parser.add_argument("-s", "--scan", help="Find charsets in memory dumps, VICE snapshots, .prg files or .d64 disk images and convert them", nargs="+")
+    parser.add_argument("--output-dir", help="Output directory for batch conversion and scanning (default is the current directory)", default=".")
+    parser.add_argument("--watch", help="Rebuild the font whenever the input files change", action="store_true")
+    parser.add_argument("--serve", help="Run a conversion server on this localhost port", type=int)
+    parser.add_argument("-w", "--workers", help="Number of worker processes for batch conversion or for vectorizing large fonts (default is the number of CPUs)", type=positiveInt)
     parser.add_argument("-x", "--xml", help="Enable XML output (for debugging purposes)", action="store_true")
+    parser.add_argument("-t", "--format", help="Output formats, written at the same time (default is ttf, or ttx with -x). With several formats, each replaces the extension of the output filename. ttc writes the uppercase and lowercase charsets as two faces of one collection", nargs="+", choices=OUTPUT_FORMATS)
     parser.add_argument("-m", "--add-missing-ascii", help="Add non-PETSCII characters for ASCII compatibility (ie. grave accent, curly braces, vertical bar, tilde, caret, backslash, and underscore)", action="store_true")
     parser.add_argument("-i", "--add-missing-danish", help="Add special Danish characters. Needed for proper compatibility with the Danish version of MAC OSX.", action="store_true")
 
     # Vectorization
-    parser.add_argument("-p", "--pixelsize", help="Pixel size in the resulting TTF file (default is 256)", default=256)
-    parser.add_argument("-d", "--descent", help="The descent below baseline in pixels (default is 1)", default=1)
+    parser.add_argument("-p", "--pixelsize", help="Pixel size in the resulting TTF file (default is 256, or 2048 divided by the glyph height for bitmap fonts)")
+    parser.add_argument("-d", "--descent", help="The descent below baseline in pixels (default is 1, or the descent of a BDF font)")
+    parser.add_argument("--no-fast-path", help="Build the glyf, loca and hmtx tables through the FontTools object model (for verifying the output)", action="store_true")
+    parser.add_argument("--edge-engine", help="Find the pixel edges glyph by glyph in Python or for all glyphs at once with NumPy (default is numpy if installed)", choices=EDGE_ENGINES, default="auto")
+    parser.add_argument("--bitmap-strikes", help="Embed the bitmaps as EBLC/EBDT strikes at these multiples of the glyph size (e.g. 1 2 3 for 8, 16 and 24 pixels), where renderers blit them instead of rasterizing the outlines", nargs="+", type=int)
+    parser.add_argument("--composites", help="Store glyphs that are moved or inverted copies of other glyphs as composite glyphs sharing their outline", action="store_true")
+    parser.add_argument("--subset-text", help="Only include the glyphs needed for this text")
+    parser.add_argument("--subset-file", help="Only include the glyphs needed for the text in this UTF-8 file")
+    parser.add_argument("--subset-petscii", help="Only include the glyphs needed for this file of PETSCII bytes (e.g. a SEQ file)")
+    parser.add_argument("--incremental", help="Keep a state file next to the output and only vectorize the glyphs that changed since the last build", action="store_true")
+    parser.add_argument("--cache-dir", help="Directory for a persistent vectorization cache shared between runs")
+    parser.add_argument("--cache-stats", help="Print vectorization cache hits and misses", action="store_true")
+
+    # Instrumentation
+    parser.add_argument("--timings", help="Write per-stage timings as JSON to this file ('-' for stdout)")
+    parser.add_argument("--timings-memory", help="Also count allocated blocks and bytes (with tracemalloc) per stage (slow)", action="store_true")
+    parser.add_argument("--profile", help="Run the conversion under cProfile and dump the pstats to this file")
 
     # Font stuff
     parser.add_argument("-a", "--add-all", help="Inserts the uppercase character set (if any) at 0xEE00...0xEEFF and the lowercase character set (if any) at 0xEF00...0xEFFF", action="store_true")
@@ -1043,9 +3541,71 @@ if __name__ == "__main__":
     parser.add_argument("-c", "--creator", help="Font creator (default is '{0}')".format(getpass.getuser()), default=getpass.getuser())
     parser.add_argument("-v", "--version", help="Sets font version number (default is '1.00')", default="1.00")
 
+    return parser
+
+def optionsFromArgs(args):
+    return {"asXML": args.xml, "addMissingASCII": args.add_missing_ascii, "addMissingDanish": args.add_missing_danish,
+            "pixelSize": int(args.pixelsize) if args.pixelsize is not None else 256, "descent": int(args.descent) if args.descent is not None else 1, "addAll": args.add_all,
+            "copyrightYear": int(args.copyrightyear), "creator": args.creator, "version": args.version,
+            "fastPath": not args.no_fast_path, "strikes": args.bitmap_strikes, "composites": args.composites,
+            "subset": readSubset(args.subset_text, args.subset_file, args.subset_petscii)}
+
+# -x is the same as "-t ttx" and can be combined with other formats.
+def formatsFromArgs(args):
+    formats = list(args.format) if args.format is not None else []
+    if args.xml and "ttx" not in formats:
+        formats.append("ttx")
+    return formats if len(formats) > 0 else ["ttf"]
+
+# "static void main()"
+if __name__ == "__main__":
+    parser = makeArgumentParser()
     args = parser.parse_args()
 
-    if args.lowercase is None and args.uppercase is None:
+    # Single fonts show the progress of the conversion (on stderr with
+    # "--timings -", which writes the JSON to stdout). The batch modes report
+    # each font on their own, so only warnings are shown there.
+    single = args.serve is None and args.batch is None and args.jobs is None and args.scan is None
+    handler = logging.StreamHandler(sys.stdout if single and args.timings != "-" else sys.stderr)
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(handler)
+    log.setLevel(logging.INFO if single else logging.WARNING)
+
+    if (args.timings is not None or args.profile is not None) and not single:
+        parser.error("--timings and --profile only work for single fonts")
+    if args.timings_memory and args.timings is None:
+        parser.error("--timings-memory needs --timings")
+    if args.timings == "-" and (args.watch or args.cache_stats):
+        # The JSON has to be the only output on stdout.
+        parser.error("--timings - can't be combined with --watch or --cache-stats")
+
+    if args.bitmap_strikes and args.pixelsize is not None and 2048 % int(args.pixelsize) != 0:
+        parser.error("--bitmap-strikes needs a pixel size that divides 2048")
+
+    if args.format is not None and (args.serve is not None or args.batch is not None or args.scan is not None):
+        parser.error("-t only works for single fonts and job manifests (use -x for TTX output)")
+
+    if args.serve is not None:
+        serve(args.serve, args.cache_dir)
+        exit(0)
+
+    if args.batch is not None:
+        success = processBatch(args.batch, args.output_dir, optionsFromArgs(args), args.name, args.workers, args.cache_dir, args.output_zip)
+        exit(0 if success else 1)
+
+    if args.jobs is not None:
+        cache = GlyphCache(cacheDir=args.cache_dir, engine=args.edge_engine)
+        success = processJobs(args.jobs, args, args.output_dir, cache, args.workers)
+        cache.close()
+        exit(0 if success else 1)
+
+    if args.scan is not None:
+        cache = GlyphCache(cacheDir=args.cache_dir, engine=args.edge_engine)
+        success = processScan(args.scan, args.output_dir, optionsFromArgs(args), args.name, cache)
+        cache.close()
+        exit(0 if success else 1)
+
+    if args.lowercase is None and args.uppercase is None and args.font is None:
         parser.print_help()
         print("")
         print("No input files! Aborting...")
@@ -1055,11 +3615,54 @@ if __name__ == "__main__":
     if fontName is None:
         fontName = "C64"
 
+    formats = formatsFromArgs(args)
+    if "ttc" in formats and len(formats) > 1:
+        parser.error("ttc can't be combined with other output formats")
+    if "ttc" in formats and args.incremental:
+        # saveCollection() doesn't keep a BuildState.
+        parser.error("--incremental can't be combined with -t ttc")
     outputFileName = args.output
     if outputFileName is None:
-        if args.xml:
-            outputFileName = fontName + ".ttx"
-        else:
-            outputFileName = fontName + ".ttf"
-
-    processCharFiles(args.lowercase, args.uppercase, outputFileName, args.xml, args.add_missing_ascii, args.add_missing_danish, int(args.pixelsize), int(args.descent), args.add_all, fontName, int(args.copyrightyear), args.creator, args.version)
+        outputFileName = fontName + "." + formats[0]
+
+    cache = GlyphCache(cacheDir=args.cache_dir, engine=args.edge_engine)
+    state = None
+    if args.incremental:
+        state = BuildState(outputFileName + STATE_SUFFIX)
+    elif args.watch:
+        state = BuildState(None)
+    timings = StageTimings(args.timings_memory) if args.timings is not None else None
+    profiler = cProfile.Profile() if args.profile is not None else None
+
+    if timings is not None:
+        timings.start()
+    if profiler is not None:
+        profiler.enable()
+
+    if args.font is not None:
+        pixelSize = int(args.pixelsize) if args.pixelsize is not None else None
+        descent = int(args.descent) if args.descent is not None else None
+        build = functools.partial(processBitmapFont, args.font, outputFileName, args.xml, pixelSize, descent, fontName, int(args.copyrightyear), args.creator, args.version, cache, not args.no_fast_path, args.hex_height, args.workers, state, formats, args.bitmap_strikes, args.composites, readSubset(args.subset_text, args.subset_file, args.subset_petscii))
+        inputFileNames = [args.font]
+    else:
+        options = optionsFromArgs(args)
+        build = functools.partial(processCharFiles, args.lowercase, args.uppercase, outputFileName, fontName=fontName, cache=cache, workers=args.workers, state=state, formats=formats, **options)
+        inputFileNames = [fileName for fileName in [args.lowercase, args.uppercase] if fileName is not None]
+    build()
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+    if timings is not None:
+        timings.stop()
+        timings.write(args.timings)
+
+    if args.watch:
+        if "ttc" in formats:
+            print("Collections are rebuilt in full on every change")
+        watchAndRebuild(inputFileNames, build)
+
+    cache.close()
+
+    if args.cache_stats:
+        cache.report()